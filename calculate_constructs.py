@@ -1,3 +1,19 @@
+from collections import namedtuple
+
+TreeStatistics = namedtuple("TreeStatistics", ["operator_counts", "depth", "fan_out", "n_nodes", "n_leaves", "n_silent_leaves"])
+TreeStatistics.__doc__ = """
+Structural statistics of a process tree.
+
+Attributes:
+operator_counts: dict mapping each operator name (SEQUENCE, XOR, PARALLEL, LOOP, OR, INTERLEAVING, PARTIALORDER)
+to the number of nodes with that operator
+depth: the number of nodes on the longest path from the root to a leaf
+fan_out: dict mapping a number of children to the number of operator nodes with that many children
+n_nodes: the number of nodes
+n_leaves: the number of leaves (activities and silent steps)
+n_silent_leaves: the number of silent (tau) leaves
+"""
+
 
 def get_operators(tree):
 
@@ -13,60 +29,135 @@ def get_operators(tree):
     # initialise the list to contain the operators
     operators = []
 
-    # Recursively traverses the tree starting from the given node.
-    # For each node with a defined operator, appends the operator to the `operators` list
-    # and continues the traversal on its children.
-    def recurse(node):
+    # Traverses the tree starting from the given node with an explicit stack, so deep trees cannot exceed the
+    # recursion limit. For each node with a defined operator, appends the operator to the `operators` list
+    # and continues the traversal on its children, in the same order as a recursive traversal.
+    stack = [tree]
+    while stack:
+        node = stack.pop()
         if node.operator is not None:
             operators.append(node.operator)
-            for child in node.children:
-                recurse(child)
-    recurse(tree)
+            stack.extend(reversed(node.children))
     return operators
 
 
-def find_gate_count(file_path):
+def tree_statistics(tree):
+
     """
-    This function discovers a process tree from an event log and then finds the number of XOR and AND gates in this process tree.
+    This function computes the operator counts, depth, fan-out histogram and leaf counts of a process tree in a
+    single iterative pass. It works on freshly discovered trees as well as on trees read from a .ptml file.
 
     Inputs:
-    file_path: the path to an event log
+    tree: a process tree
 
     Outputs:
-    xor_count: the number of XOR gates in the discovered process tree
-    and_count: the number of AND gates in the discovered process tree
+    statistics: the TreeStatistics of the tree
     """
-    from pm4py.algo.discovery.inductive import algorithm as inductive_miner
-    from pm4py.objects.log.importer.xes.importer import apply as xes_importer
+    from pm4py.objects.process_tree.obj import Operator
 
-    # read in the event log
-    log = xes_importer(file_path)
+    operator_counts = {operator.name: 0 for operator in Operator}
+    fan_out = {}
+    depth = 0
+    n_nodes = 0
+    n_leaves = 0
+    n_silent_leaves = 0
 
-    # discover a process tree
-    parameters = {
-        "noise_threshold": 0.2 
-    }
+    stack = [(tree, 1)]
+    while stack:
+        node, node_depth = stack.pop()
+        n_nodes += 1
+        depth = max(depth, node_depth)
 
-    tree = inductive_miner.apply(log, variant=inductive_miner.Variants.IMf, parameters=parameters)
+        if node.operator is None:
+            n_leaves += 1
+            if node.label is None:
+                n_silent_leaves += 1
+            continue
 
+        operator_counts[node.operator.name] += 1
+        n_children = len(node.children)
+        fan_out[n_children] = fan_out.get(n_children, 0) + 1
+        stack.extend((child, node_depth + 1) for child in node.children)
 
-    # find the operators in the process tree
+    return TreeStatistics(operator_counts, depth, dict(sorted(fan_out.items())), n_nodes, n_leaves, n_silent_leaves)
+
+
+def count_gates(tree):
+    """
+    This function finds the number of XOR and AND gates in a process tree.
 
-    operators = get_operators(tree)
+    Inputs:
+    tree: a process tree
 
-    # initialise the counts
-    xor_count = 0
-    and_count = 0
+    Outputs:
+    xor_count: the number of XOR gates in the process tree
+    and_count: the number of AND gates in the process tree
+    """
 
     # count the number of XOR (X) and AND (+) operators in the tree
-    for operator in operators:
-        operator = str(operator)
-        if operator == "X":
-            xor_count += 1
-        if operator == "+":
-            and_count += 1
+    operator_counts = tree_statistics(tree).operator_counts
+
+    return operator_counts["XOR"], operator_counts["PARALLEL"]
+
+
+def discover_process_tree(log):
+    """
+    This function discovers a process tree from an event log using the inductive miner (IMf, noise threshold 0.2).
+
+    Inputs:
+    log: an event log
+
+    Outputs:
+    tree: the discovered process tree
+    """
+    from discover_petri_nets import discover_process_tree as discover_tree
+
+    # same miner and noise threshold as the Petri net discovery
+    return discover_tree(log, multi_processing=False)
+
+
+def load_process_tree(file_path):
+    """
+    This function returns the process tree of an event log, reading the .ptml file written next to the log by
+    discover_petri_nets.py when it is up to date. Otherwise the tree is discovered and saved there for later runs.
+
+    Inputs:
+    file_path: the path to an event log
+
+    Outputs:
+    tree: the process tree of the event log
+    """
+    import pm4py
+    from discover_petri_nets import get_ptml_path, is_up_to_date
+
+    ptml_path = get_ptml_path(file_path)
+    if is_up_to_date(file_path, [ptml_path]):
+        return pm4py.read_ptml(ptml_path)
+
+    from event_log_cache import load_event_log
+
+    # read in the event log
+    print("no up to date process tree found, discovering it...")
+    tree = discover_process_tree(load_event_log(file_path))
+    pm4py.write_ptml(tree, ptml_path)
+    return tree
+
+
+def find_gate_count(file_path):
+    """
+    This function finds the number of XOR and AND gates in the process tree of an event log, using the tree stored by
+    discover_petri_nets.py if there is one.
+
+    Inputs:
+    file_path: the path to an event log
+
+    Outputs:
+    xor_count: the number of XOR gates in the discovered process tree
+    and_count: the number of AND gates in the discovered process tree
+    """
+    tree = load_process_tree(file_path)
 
-    return xor_count, and_count
+    return count_gates(tree)
 
 if __name__ == "__main__":
     from load_config import load_config
@@ -82,7 +173,11 @@ if __name__ == "__main__":
     # Construct dataset path
     file_path = os.path.join(config["project_root"], "data", args.log)
 
-    xor_count, and_count = find_gate_count(file_path)
+    statistics = tree_statistics(load_process_tree(file_path))
+    xor_count, and_count = statistics.operator_counts["XOR"], statistics.operator_counts["PARALLEL"]
 
     print("Number of XOR gates in", args.log, ":", xor_count)
     print("Number of AND gates in", args.log, ": ", and_count)
+    print("Operator counts in", args.log, ":", statistics.operator_counts)
+    print("Depth, nodes, leaves and silent leaves of the tree:", statistics.depth, statistics.n_nodes, statistics.n_leaves, statistics.n_silent_leaves)
+    print("Fan-out histogram (children: operator nodes):", statistics.fan_out)
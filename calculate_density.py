@@ -1,29 +1,44 @@
-def find_petri_net_density(file_path):
+def petri_net_density(net):
     """
-    This function finds the density of a given petri net using the density for a directed graph.
+    This function finds the density of a Petri net using the density for a directed graph.
 
     Inputs:
-    file_path: the path to a Petri net
+    net: the NetArrays of a Petri net (see petri_net_cache.read_net_arrays)
 
     Outputs:
     density: the density as a float
+    no_nodes: the number of nodes (places and transitions)
     """
 
-    import pm4py
-
-    net, im, fm = pm4py.read_pnml(file_path)
-
     # calculate the total number of nodes
-    no_nodes = len(net.transitions) + len(net.places)
+    no_nodes = net.n_transitions + net.n_places
 
     # calculate the number of edges
-    no_edges = len(net.arcs)
+    no_edges = len(net.arc_source)
 
     # calculate the density using the density of a directed graph
     density = no_edges/(no_nodes*(no_nodes - 1))
 
     return density, no_nodes
 
+
+def find_petri_net_density(file_path):
+    """
+    This function finds the density of a given petri net using the density for a directed graph.
+
+    Inputs:
+    file_path: the path to a Petri net
+
+    Outputs:
+    density: the density as a float
+    """
+
+    from petri_net_cache import read_net_arrays
+
+    net, im, fm = read_net_arrays(file_path)
+
+    return petri_net_density(net)
+
 if __name__ == "__main__":
     from load_config import load_config
     import os
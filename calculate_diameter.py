@@ -1,47 +1,173 @@
-def find_petri_net_diameter(file_path):
+import numpy as np
+
+# graph of the worker processes, set once per process by _init_diameter_worker
+_worker_graph = None
+
+
+def adjacency_matrix(net):
+
+    """
+    This function builds the sparse adjacency matrix of a Petri net, with one row and column per place and transition.
+
+    Inputs:
+    net: the NetArrays of a Petri net (see petri_net_cache.read_net_arrays)
+
+    Outputs:
+    graph: a scipy.sparse CSR matrix with a 1 for every arc
+    """
+    from scipy.sparse import csr_matrix
+
+    # the postsets of the NetArrays are already in CSR form
+    data = np.ones(len(net.post_indices), dtype=np.int8)
+    return csr_matrix((data, net.post_indices, net.post_indptr), shape=(net.n_nodes, net.n_nodes))
+
+
+def _eccentricity_chunk(graph, sources):
+    """
+    Returns, for each source, the longest shortest path to a node reachable from it and the number of reachable nodes.
+    """
+    from scipy.sparse.csgraph import shortest_path
+
+    distances = shortest_path(graph, directed=True, unweighted=True, indices=sources)
+    finite = np.isfinite(distances)
+    distances[~finite] = 0
+    return distances.max(axis=1).astype(np.int64), finite.sum(axis=1)
+
+
+def _init_diameter_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _worker_eccentricity_chunk(sources):
+    return _eccentricity_chunk(_worker_graph, sources)
+
+
+def node_eccentricities(graph, workers=1, chunk_size=256):
+
+    """
+    This function finds the eccentricity of every node of a directed graph, its longest shortest path to a node it
+    can reach.
+
+    Shortest paths are computed for chunk_size sources at a time and only their maxima are kept, so memory grows with
+    chunk_size times the number of nodes rather than with the number of node pairs. Chunks can be processed on a
+    process pool, which receives the graph once per worker.
+
+    Inputs:
+    graph: a scipy.sparse adjacency matrix
+    workers: the number of processes used
+    chunk_size: the number of sources whose distances are held in memory at once
+
+    Outputs:
+    eccentricity: int64 array with the eccentricity of every node
+    reach: int64 array with the number of nodes reachable from every node (including itself)
+    """
+    n_nodes = graph.shape[0]
+    chunks = [np.arange(start, min(start + chunk_size, n_nodes)) for start in range(0, n_nodes, chunk_size)]
+
+    if workers <= 1 or len(chunks) <= 1:
+        results = [_eccentricity_chunk(graph, chunk) for chunk in chunks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_init_diameter_worker,
+                                 initargs=(graph,)) as executor:
+            results = list(executor.map(_worker_eccentricity_chunk, chunks))
+
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return (np.concatenate([eccentricity for eccentricity, _ in results]),
+            np.concatenate([reach for _, reach in results]).astype(np.int64))
+
+
+def double_sweep_diameter(graph, sweeps=4, start=None):
+
+    """
+    This function finds a lower bound on the diameter of a directed graph with repeated double sweeps.
+
+    Each sweep runs a breadth-first search forwards from a node and then backwards (on the reversed graph) from the
+    farthest node it reached, and restarts from the farthest node of the backward search. Every search gives the
+    length of a real shortest path, so the result never exceeds the diameter and is often equal to it.
+
+    Inputs:
+    graph: a scipy.sparse adjacency matrix
+    sweeps: the number of double sweeps
+    start: the first node (default: a node without incoming arcs, such as the source place of a workflow net)
+
+    Outputs:
+    bound: a lower bound on the diameter
+    """
+    from scipy.sparse.csgraph import shortest_path
+
+    n_nodes = graph.shape[0]
+    if n_nodes == 0:
+        return 0
+
+    if start is None:
+        in_degree = np.bincount(graph.indices, minlength=n_nodes)
+        roots = np.flatnonzero(in_degree == 0)
+        start = int(roots[0]) if len(roots) > 0 else 0
+
+    reverse = graph.T.tocsr()
+    bound = 0
+    node = start
+    for _ in range(sweeps):
+        for direction in (graph, reverse):
+            distances = shortest_path(direction, directed=True, unweighted=True, indices=node)
+            distances[np.isinf(distances)] = -1
+            node = int(np.argmax(distances))
+            bound = max(bound, int(distances[node]))
+
+    return bound
+
+
+def petri_net_diameter(net, workers=1, chunk_size=256, bound=False):
 
     """
     This function finds the diameter of a Petri net using the longest shortest paths.
 
+    Shortest paths are computed on a sparse adjacency matrix a chunk of sources at a time (see node_eccentricities),
+    without storing the distances between all pairs of nodes.
+
     Inputs:
-    file_path: the file path to the Petri net
+    net: the NetArrays of a Petri net (see petri_net_cache.read_net_arrays)
+    workers: the number of processes used for the exact diameter
+    chunk_size: the number of sources whose distances are held in memory at once
+    bound: if True, only return the double-sweep lower bound (see double_sweep_diameter), which is much faster on
+    very large nets
 
     Outputs:
     diameter: the diameter of the Petri net
     """
+    graph = adjacency_matrix(net)
 
-    import networkx as nx
-    import pm4py
+    if bound:
+        return double_sweep_diameter(graph)
 
-    # read in the petri net path
-    net, im, fm = pm4py.read_pnml(file_path)
+    eccentricity, _ = node_eccentricities(graph, workers=workers, chunk_size=chunk_size)
+    return int(eccentricity.max()) if len(eccentricity) > 0 else 0
 
-    # initialise a directed graph
-    G = nx.DiGraph()
 
-    # add the places from the net as nodes to G
-    for place in net.places:
-        G.add_node(place.name, type="place")
+def find_petri_net_diameter(file_path, workers=1, bound=False):
 
-    # add transitions from the net as nodes to G
-    for transition in net.transitions:
-        label = transition.label if transition.label else transition.name
-        G.add_node(transition.name, type="transition", label=label)
+    """
+    This function finds the diameter of a Petri net using the longest shortest paths.
 
-    # add the arcs from the net as edges in G
-    for arc in net.arcs:
-        G.add_edge(arc.source.name, arc.target.name)
+    Inputs:
+    file_path: the file path to the Petri net
+    workers: the number of processes used
+    bound: if True, only return a double-sweep lower bound on the diameter
 
-    # find the shortest path length between all nodes in G
-    lengths = dict(nx.all_pairs_shortest_path_length(G))
+    Outputs:
+    diameter: the diameter of the Petri net
+    """
+
+    from petri_net_cache import read_net_arrays
 
-    # find the longest shortest path
-    diameter = 0
-    for source in lengths:
-        for target in lengths[source]:
-            diameter = max(diameter, lengths[source][target])
+    # read in the petri net path
+    net, im, fm = read_net_arrays(file_path)
 
-    return diameter
+    return petri_net_diameter(net, workers=workers, bound=bound)
 
 if __name__ == "__main__":
     from load_config import load_config
@@ -52,10 +178,15 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Run script on a Petri net.")
     parser.add_argument("--pn", type=str, required=True, choices=["brazil_1.pnml", "brazil_2.pnml", "honduras_coordinated.pnml", "honduras_uncoordinated.pnml", "uae_coordinated.pnml", "uae_uncoordinated.pnml"], help="Petri net filename (relative to project root)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for the exact diameter")
+    parser.add_argument("--bound", action="store_true", help="Only compute a fast double-sweep lower bound on the diameter")
     args = parser.parse_args()
 
     # Construct dataset path
     file_path = os.path.join(config["project_root"], "data", args.pn)
 
-    diameter = find_petri_net_diameter(file_path)
-    print("Diameter of", args.pn, ": ", diameter)
\ No newline at end of file
+    diameter = find_petri_net_diameter(file_path, workers=args.workers, bound=args.bound)
+    if args.bound:
+        print("Diameter lower bound of", args.pn, ": ", diameter)
+    else:
+        print("Diameter of", args.pn, ": ", diameter)
\ No newline at end of file
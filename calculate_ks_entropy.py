@@ -1,6 +1,9 @@
-import pm4py
-from free_choice_SPN import generate_P
-from pm4py.objects.log.importer.xes import importer as xes_importer
+from collections import namedtuple
+from pm4py.objects.log.obj import EventLog
+from free_choice_SPN import generate_transition_frequencies, get_trace_variants, replay_variant_counts
+from petri_net_index import PetriNetIndex, get_net_index
+from event_log_cache import LogColumns, load_event_log, log_to_columns, columns_to_event_log
+from petri_net_cache import load_petri_net
 import numpy as np
 
 # Because a free-choice stochastic Petri net cannot be precisely represented as a Markov chain, its behavior can be approximated using a reachability graph. 
@@ -26,7 +29,7 @@ def get_preceding_places(petri_net, transition):
     Returns:
     - List of preceding places.
     """
-    preceding_places = [arc.source for arc in petri_net.arcs if arc.target == transition]
+    preceding_places = list(get_net_index(petri_net).transition_preset.get(transition, ()))
     return preceding_places
 
 def get_output_transitions(petri_net, place):
@@ -40,7 +43,7 @@ def get_output_transitions(petri_net, place):
     Returns:
     - List of output transitions.
     """
-    output_transitions = [arc.target for arc in petri_net.arcs if arc.source == place]
+    output_transitions = list(get_net_index(petri_net).place_postset.get(place, ()))
     return output_transitions
 
 
@@ -49,54 +52,329 @@ def get_transition_by_name(transitions, name):
     Get a transition object by its name.
     
     Parameters:
-    - transitions: List of Transition objects.
+    - transitions: List of Transition objects, or a PetriNetIndex.
     - name: The name of the transition to find.
 
     Returns:
     - The transition object if found, else None.
     """
+    if isinstance(transitions, PetriNetIndex):
+        return transitions.label_to_transition.get(name)
     for transition in transitions:
         if transition.label == name:
             return transition
     return None
 
-def calculate_ks_entropy(pn_file_path, log_file_path):
-    net, im, fm = pm4py.read_pnml(pn_file_path)
-    variant = xes_importer.Variants.ITERPARSE
-    parameters = {variant.value.Parameters.TIMESTAMP_SORT: True}
-    log = xes_importer.apply(log_file_path, variant=variant, parameters=parameters)
+# every array is indexed by place ID or transition ID, as in the net's NetArrays
+KSEntropy = namedtuple("KSEntropy", ["entropy", "mu", "P", "place_entropy", "contributions"])
+KSEntropy.__doc__ = """
+The KS entropy of a free-choice stochastic Petri net and its terms.
+
+Attributes:
+entropy: the KS entropy, the sum of contributions
+mu: array with the activation frequency of every place (0 for places that are never activated)
+P: array with the probability of every transition
+place_entropy: array with the entropy of the choice at every place, -sum P log2 P over its output transitions
+contributions: array with the contribution of every place to the entropy, mu * place_entropy
+"""
+
+
+def activation_places(arrays, activity_names):
+    """
+    Returns, for each activity, the ID of the single preceding place of the first transition with that label, or -1
+    if there is no such transition or it has several preceding places.
+    """
+    first_transition = {}
+    for i, label in enumerate(arrays.transition_labels.tolist()):
+        if not arrays.silent[i] and label not in first_transition:
+            first_transition[label] = arrays.n_places + i
+
+    preset_size = np.diff(arrays.pre_indptr)
+    places = np.full(len(activity_names), -1, dtype=np.int64)
+    for code, name in enumerate(activity_names):
+        node = first_transition.get(name)
+        if node is not None and preset_size[node] == 1:
+            places[code] = arrays.pre_indices[arrays.pre_indptr[node]]
+    return places
+
+
+def place_activation_counts(arrays, columns):
+    """
+    Counts how often each place is activated by the events of a log, as the single preceding place of the transition
+    of the event's activity.
+
+    Inputs:
+    arrays: the NetArrays of the net
+    columns: the LogColumns of the log
+
+    Outputs:
+    counts: int64 array with the activation count of every place
+    """
+    places = activation_places(arrays, columns.activity_names)[columns.activity_codes]
+    return np.bincount(places[places >= 0], minlength=arrays.n_places)
+
+
+def _choice_arcs(arrays):
+    """
+    Returns the arcs from places to transitions as (place IDs, transition IDs - n_places) arrays.
+    """
+    is_choice = arrays.arc_source < arrays.n_places
+    return arrays.arc_source[is_choice].astype(np.int64), arrays.arc_target[is_choice].astype(np.int64) - arrays.n_places
+
+
+def _sum_by_place(arc_place, values, n_places):
+    """
+    Sums values over the arcs of each place along the last axis, adding the arcs of a place in arc order.
+    """
+    order = np.argsort(arc_place, kind="stable")
+    places, starts = np.unique(arc_place[order], return_index=True)
+    sums = np.zeros(values.shape[:-1] + (n_places,))
+    if len(order) > 0:
+        sums[..., places] = np.add.reduceat(values[..., order], starts, axis=-1)
+    return sums
 
-    freq_of_places = {}
 
+def transition_probabilities(arrays, freq):
+    """
+    This function turns transition activation counts into the probability of each transition among the output
+    transitions of its preceding place, as generate_P does.
+
+    The probabilities are the entries of the sparse place x transition matrix of the net, held as one value per
+    place-to-transition arc. As in generate_P, a transition with several preceding places takes the probability found
+    at the last of them.
 
-    for trace in log:
-        for activity in trace:
-            name = activity["concept:name"]
-            transition = get_transition_by_name(net.transitions, name)
-            places = get_preceding_places(net,transition)
-            if len(places) == 1:
-                place = places[0]
-                if place not in freq_of_places:
-                    freq_of_places[place] = 1
-                else:
-                    freq_of_places[place] += 1
+    Inputs:
+    arrays: the NetArrays of the net
+    freq: array with the activation count of every transition, or a 2D array with one row of counts per replicate
 
-    total = sum(freq_of_places.values())
+    Outputs:
+    P: float array with the probability of every transition, with the shape of freq
+    """
+    arc_place, arc_transition = _choice_arcs(arrays)
+    arc_freq = np.asarray(freq, dtype=np.float64)[..., arc_transition]
 
-    mu = {k: v / total for k, v in freq_of_places.items()}
+    total = _sum_by_place(arc_place, arc_freq, arrays.n_places)[..., arc_place]
+    arc_P = np.divide(arc_freq, total, out=np.zeros_like(arc_freq), where=total > 0)
 
-    P = generate_P(log, net, im, fm)
+    # places are visited in ID order, so the last write wins
+    last = np.lexsort((arc_place, arc_transition))
+    is_last = np.append(arc_transition[last][1:] != arc_transition[last][:-1], True)
+    P = np.zeros(arc_freq.shape[:-1] + (arrays.n_transitions,))
+    P[..., arc_transition[last][is_last]] = arc_P[..., last[is_last]]
+    return P
 
-    ks = 0
-    for place in mu:
-        transitions = get_output_transitions(net, place)
-        total_sum = 0
-        for transition in transitions:
-            if P[transition.name] > 0:
-                total_sum += -(P[transition.name])*np.log2(P[transition.name])
-        total_sum*=mu[place]
-        ks+=total_sum
-    return ks
+
+def place_entropies(arrays, P):
+    """
+    Returns the entropy -sum P log2 P over the output transitions of every place, skipping transitions with P = 0.
+    P can hold one row of probabilities per replicate.
+    """
+    arc_place, arc_transition = _choice_arcs(arrays)
+    arc_P = P[..., arc_transition]
+    terms = np.zeros_like(arc_P)
+    positive = arc_P > 0
+    terms[positive] = -arc_P[positive] * np.log2(arc_P[positive])
+    return _sum_by_place(arc_place, terms, arrays.n_places)
+
+
+def ks_entropy_terms(net, im, fm, log, columns=None, freq=None, workers=None):
+    """
+    Calculate the Kolmogorov-Sinai entropy of a free-choice stochastic Petri net and the contribution of every place.
+
+    Place activations are counted with array lookups from each activity to its transition and the transition's
+    single preceding place. The log is replayed once to count the transition activations behind P, and the sum over
+    places and their output transitions is computed with NumPy.
+
+    Parameters:
+    - net: The Petri net object.
+    - im: The initial marking.
+    - fm: The final marking.
+    - log: The event log the net was discovered from.
+    - columns: The LogColumns of the log, if already available.
+    - freq: The transition activation counts of the log (see generate_transition_frequencies), if already available.
+    - workers: The number of processes used to replay the log.
+
+    Returns:
+    - A KSEntropy.
+    """
+    index = get_net_index(net)
+    arrays = index.arrays
+
+    if columns is None:
+        columns = log if isinstance(log, LogColumns) else log_to_columns(log)
+    if freq is None:
+        if isinstance(log, LogColumns):
+            log = columns_to_event_log(log)
+        freq = generate_transition_frequencies(log, net, im, fm, workers=workers)
+
+    counts = place_activation_counts(arrays, columns)
+    total = counts.sum()
+    mu = counts / total if total > 0 else np.zeros(arrays.n_places)
+
+    freq = np.array([freq[name] for name in arrays.transition_names.tolist()], dtype=np.float64)
+    P = transition_probabilities(arrays, freq)
+    place_entropy = place_entropies(arrays, P)
+    contributions = mu * place_entropy
+
+    return KSEntropy(float(contributions.sum()), mu, P, place_entropy, contributions)
+
+
+def ks_entropy(net, im, fm, log, columns=None):
+    """
+    Calculate the Kolmogorov-Sinai entropy of a free-choice stochastic Petri net.
+
+    Parameters:
+    - net: The Petri net object.
+    - im: The initial marking.
+    - fm: The final marking.
+    - log: The event log the net was discovered from.
+    - columns: The LogColumns of the log, if already available.
+
+    Returns:
+    - The KS entropy.
+    """
+    return ks_entropy_terms(net, im, fm, log, columns=columns).entropy
+
+
+KSBootstrap = namedtuple("KSBootstrap", ["entropy", "low", "high", "replicates"])
+KSBootstrap.__doc__ = """
+A bootstrap confidence interval of the KS entropy.
+
+Attributes:
+entropy: the KS entropy of the log itself
+low, high: the bounds of the percentile confidence interval
+replicates: array with the KS entropy of every bootstrap replicate
+"""
+
+# count matrices held by each worker process of a parallel bootstrap, set once by _init_bootstrap_worker
+_worker_counts = None
+
+
+def variant_count_matrices(net, im, fm, log):
+    """
+    This function replays each distinct trace variant of a log once and returns its counts, from which the place
+    activations and transition activations of any reweighting of the traces follow by a matrix product.
+
+    Inputs:
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
+    log: the event log the net was discovered from, or its LogColumns
+
+    Outputs:
+    frequencies: int64 array with the number of traces of each variant
+    place_counts: int64 array with one row per variant, counting the activations of each place by one of its traces
+    transition_counts: int64 array with one row per variant, counting the transitions one of its traces activates
+    """
+    arrays = get_net_index(net).arrays
+
+    if isinstance(log, LogColumns):
+        log = columns_to_event_log(log)
+    variants = get_trace_variants(log)
+
+    frequencies = np.array([frequency for _, frequency in variants], dtype=np.int64)
+    transition_counts = replay_variant_counts(variants, net, im, fm)
+
+    columns = log_to_columns(EventLog([trace for trace, _ in variants]))
+    places = activation_places(arrays, columns.activity_names)[columns.activity_codes]
+    activated = places >= 0
+    place_counts = np.bincount(columns.case_index[activated] * arrays.n_places + places[activated],
+                               minlength=len(variants) * arrays.n_places).reshape(len(variants), arrays.n_places)
+
+    return frequencies, place_counts, transition_counts
+
+
+def reweighted_ks_entropy(arrays, weights, place_counts, transition_counts):
+    """
+    This function computes the KS entropy for every row of trace variant weights.
+
+    Inputs:
+    arrays: the NetArrays of the net
+    weights: array with one row per replicate and one column per variant, the number of times each variant is drawn
+    place_counts, transition_counts: the per-variant counts from variant_count_matrices
+
+    Outputs:
+    entropy: array with the KS entropy of every replicate
+    """
+    counts = weights @ place_counts
+    totals = counts.sum(axis=-1, keepdims=True)
+    mu = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+    P = transition_probabilities(arrays, weights @ transition_counts)
+    return (mu * place_entropies(arrays, P)).sum(axis=-1)
+
+
+def _init_bootstrap_worker(arrays, frequencies, place_counts, transition_counts):
+    global _worker_counts
+    _worker_counts = (arrays, frequencies, place_counts, transition_counts)
+
+
+def _bootstrap_batch(seed, size):
+    arrays, frequencies, place_counts, transition_counts = _worker_counts
+    rng = np.random.default_rng(seed)
+
+    # drawing len(log) traces with replacement draws each variant in proportion to its frequency
+    n_traces = frequencies.sum()
+    weights = rng.multinomial(n_traces, frequencies / n_traces, size=size)
+    return reweighted_ks_entropy(arrays, weights, place_counts, transition_counts)
+
+
+def bootstrap_ks_entropy(net, im, fm, log, replicates=1000, confidence=0.95, seed=None, workers=1, batch_size=100,
+                         counts=None):
+    """
+    This function computes a bootstrap confidence interval of the KS entropy by resampling the traces of the log.
+
+    Each distinct trace variant is replayed only once. A replicate draws len(log) traces with replacement, and its
+    place and transition activations are the per-variant counts weighted by how often each variant was drawn, so a
+    batch of replicates is a pair of matrix products. Batches are seeded from one SeedSequence, so the replicates
+    only depend on seed and batch_size and not on the number of workers.
+
+    Inputs:
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
+    log: the event log the net was discovered from, or its LogColumns
+    replicates: the number of bootstrap replicates
+    confidence: the coverage of the percentile interval
+    seed: seed of the random number generator
+    workers: the number of processes the batches of replicates are spread over
+    batch_size: the number of replicates computed in one matrix product
+    counts: the output of variant_count_matrices, if already available
+
+    Outputs:
+    bootstrap: a KSBootstrap
+    """
+    arrays = get_net_index(net).arrays
+    if counts is None:
+        counts = variant_count_matrices(net, im, fm, log)
+    frequencies, place_counts, transition_counts = counts
+    entropy = float(reweighted_ks_entropy(arrays, frequencies, place_counts, transition_counts))
+
+    sizes = [min(batch_size, replicates - start) for start in range(0, replicates, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    initargs = (arrays, frequencies, place_counts, transition_counts)
+
+    if workers <= 1 or len(sizes) <= 1:
+        _init_bootstrap_worker(*initargs)
+        batches = [_bootstrap_batch(batch_seed, size) for batch_seed, size in zip(seeds, sizes)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(sizes)), initializer=_init_bootstrap_worker,
+                                 initargs=initargs) as executor:
+            batches = list(executor.map(_bootstrap_batch, seeds, sizes))
+
+    values = np.concatenate(batches) if batches else np.zeros(0)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(values, [alpha, 1 - alpha]) if len(values) > 0 else (entropy, entropy)
+    return KSBootstrap(entropy, float(low), float(high), values)
+
+
+def calculate_ks_entropy(pn_file_path, log_file_path):
+    net, im, fm = load_petri_net(pn_file_path)
+    log = load_event_log(log_file_path)
+
+    return ks_entropy(net, im, fm, log)
 
 
 if __name__ == "__main__":
@@ -108,6 +386,11 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Run script on a Petri net.")
     parser.add_argument("--pn", type=str, required=True, choices=["brazil_1.pnml", "brazil_2.pnml", "honduras_coordinated.pnml", "honduras_uncoordinated.pnml", "uae_coordinated.pnml", "uae_uncoordinated.pnml"], help="Petri net filename (relative to project root)")
+    parser.add_argument("--bootstrap", type=int, default=0, help="Number of bootstrap replicates used for a confidence interval (default: none)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Coverage of the bootstrap confidence interval")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the bootstrap resampling")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for the bootstrap replicates")
+    parser.add_argument("--places", type=int, default=0, help="Also print the places with the largest contributions to the entropy")
     args = parser.parse_args()
 
     split_pn_path = args.pn.split(sep=".pnml")
@@ -116,5 +399,26 @@ if __name__ == "__main__":
     pn_file_path = os.path.join(config["project_root"], "data", args.pn)
     log_file_path = os.path.join(config["project_root"], "data", log_name)
 
-    ks = calculate_ks_entropy(pn_file_path, log_file_path)
-    print("KS of", args.pn, ": ", ks)
\ No newline at end of file
+    net, im, fm = load_petri_net(pn_file_path)
+    log = load_event_log(log_file_path)
+
+    freq = counts = None
+    if args.bootstrap > 0:
+        # the variants are replayed once, for both the entropy and its replicates
+        counts = variant_count_matrices(net, im, fm, log)
+        freq = dict(zip(get_net_index(net).arrays.transition_names.tolist(), counts[0] @ counts[2]))
+
+    terms = ks_entropy_terms(net, im, fm, log, freq=freq)
+    print("KS of", args.pn, ": ", terms.entropy)
+
+    if args.bootstrap > 0:
+        bootstrap = bootstrap_ks_entropy(net, im, fm, log, replicates=args.bootstrap, confidence=args.confidence,
+                                         seed=args.seed, workers=args.workers, counts=counts)
+        print("{:.0%} confidence interval of KS of {} : [{}, {}]".format(args.confidence, args.pn, bootstrap.low, bootstrap.high))
+
+    if args.places > 0:
+        place_names = get_net_index(net).arrays.place_names
+        for place in np.argsort(-terms.contributions, kind="stable")[:args.places]:
+            if terms.contributions[place] > 0:
+                print("  {}: mu = {:.4f}, entropy = {:.4f}, contribution = {:.4f}".format(
+                    place_names[place], terms.mu[place], terms.place_entropy[place], terms.contributions[place]))
\ No newline at end of file
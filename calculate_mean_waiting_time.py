@@ -1,12 +1,121 @@
-import pm4py
-from free_choice_SPN import generate_F
-from pm4py.objects.log.importer.xes import importer as xes_importer
+from collections import namedtuple
+from free_choice_SPN import DelayArrays, DelayDistributions, delays_to_arrays, grouped_sum, load_delay_distributions
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.stats import ks_2samp
 
+COUNTRIES = ["uae", "brazil", "honduras"]
 
-def calculate_mean_waiting_times(c_input_file, u_input_file):
+
+def _grouped_quantiles(sorted_values, indptr, quantiles):
+    """
+    Returns the quantiles of each group of sorted values as one row per quantile, interpolated linearly as by
+    np.quantile, with NaN for empty groups.
+    """
+    counts = np.diff(indptr)
+    nonempty = counts > 0
+    result = np.full((len(quantiles), len(counts)), np.nan)
+
+    for row, q in enumerate(quantiles):
+        position = indptr[:-1][nonempty] + q * (counts[nonempty] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        result[row, nonempty] = sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+    return result
+
+
+WaitingTimeStatistics = namedtuple("WaitingTimeStatistics", ["names", "count", "sum", "mean", "variance", "median",
+                                                             "quantiles"])
+WaitingTimeStatistics.__doc__ = """
+Statistics of the waiting times of every transition, as computed by waiting_time_statistics.
+
+Every array has one entry per transition, in the order of names. Delays are divided by the scale passed to
+waiting_time_statistics, and transitions without delays get NaN in every array except count and sum.
+
+Attributes:
+names: the names of the transitions
+count: array with the number of delays of every transition
+sum: array with the total delay of every transition
+mean: array with the mean delay of every transition
+variance: array with the population variance of the delays of every transition, as np.var
+median: array with the median delay of every transition
+quantiles: 2D array with one row per requested quantile and one column per transition
+"""
+
+
+def waiting_time_statistics(F, quantiles=(0.25, 0.75), scale=1000):
+
+    """
+    This function computes statistics of the waiting times of every transition with grouped array reductions.
+
+    Inputs:
+    F - the dictionary of delays per transition returned by generate_F, or its DelayArrays
+    quantiles - the quantiles computed for every transition, besides the median
+    scale - every delay is divided by scale, as in get_mean_waiting_times
+
+    Outputs:
+    statistics - a WaitingTimeStatistics with one entry per transition in each array (NaN for transitions without
+    delays), and quantiles holding one row per requested quantile
+    """
+
+    arrays = F if isinstance(F, DelayArrays) else delays_to_arrays(F)
+    delays = arrays.delays / scale
+    counts = np.diff(arrays.indptr)
+    groups = np.repeat(np.arange(len(counts)), counts)
+
+    sums = grouped_sum(delays, arrays.indptr)
+    means = np.divide(sums, counts, out=np.full(len(counts), np.nan), where=counts > 0)
+
+    # population variance, as np.var
+    deviations = grouped_sum((delays - means[groups]) ** 2, arrays.indptr)
+    variances = np.divide(deviations, counts, out=np.full(len(counts), np.nan), where=counts > 0)
+
+    # sort the delays within each group in one pass
+    sorted_delays = delays[np.lexsort((delays, groups))]
+    percentiles = _grouped_quantiles(sorted_delays, arrays.indptr, (0.5,) + tuple(quantiles))
+
+    return WaitingTimeStatistics(arrays.names, counts, sums, means, variances, percentiles[0], percentiles[1:])
+
+
+def get_mean_waiting_times(F):
+
+    """
+    This function calculates the mean waiting time of every transition with a positive total delay.
+
+    Inputs:
+    F - the dictionary of delays per transition returned by generate_F, its DelayArrays, or the stored
+    DelayDistributions of the net
+
+    Outputs:
+    mean_times - array of mean time differences
+    """
+
+    if isinstance(F, DelayDistributions):
+        mean_times = F.mean / 1000
+        return mean_times[(F.count > 0) & (mean_times > 0)]
+
+    statistics = waiting_time_statistics(F, quantiles=())
+
+    return statistics.mean[statistics.sum > 0]
+
+
+def dataset_mean_waiting_times(input_file):
+
+    """
+    This function calculates the mean waiting times of one dataset from the delay distributions stored next to its
+    Petri net, which are fitted from the event log first if needed.
+
+    Inputs:
+    input_file - the path of the dataset, without the .pnml and .xes extensions
+
+    Outputs:
+    mean_times - the mean time differences
+    """
+
+    return get_mean_waiting_times(load_delay_distributions(input_file + ".pnml", input_file + ".xes"))
+
+
+def calculate_mean_waiting_times(c_input_file, u_input_file, workers=1):
 
     """
     This function calculates the mean waiting times for an uncoordinated and coordinated dataset using the event log and Petri net.
@@ -14,76 +123,128 @@ def calculate_mean_waiting_times(c_input_file, u_input_file):
     Inputs:
     c_input_file - the input path for the coordinated dataset
     u_input_file - the input path for the uncoordianted dataset
+    workers - if greater than 1, the two datasets are processed in separate processes
 
     Outputs:
     mean_timesc - the mean time differences for the coordinated data
     mean_timesu - the mean time differences for the uncoordinated data
     """
 
-    netc, initial_markingc, final_markingc = pm4py.read_pnml(c_input_file + ".pnml")
-    variant = xes_importer.Variants.ITERPARSE
-    parameters = {variant.value.Parameters.TIMESTAMP_SORT: True}
-    logc = xes_importer.apply(c_input_file + '.xes', variant=variant, parameters=parameters)
+    mean_timesc, mean_timesu = map_datasets([c_input_file, u_input_file], workers)
 
-    netu, initial_markingu, final_markingu = pm4py.read_pnml(u_input_file + ".pnml")
-    logu = xes_importer.apply(u_input_file + ".xes", variant=variant, parameters=parameters)
+    return mean_timesc, mean_timesu
 
-    Fc = generate_F(netc, logc)
-    Fu = generate_F(netu, logu)
 
+def map_datasets(input_files, workers=1):
 
-    mean_timesc = []
-    mean_timesu = []
+    """
+    This function calculates the mean waiting times of several datasets, each in its own process if workers > 1.
+
+    Inputs:
+    input_files - the paths of the datasets, without extensions
+    workers - the number of processes
 
-    for f in Fc:
-        sum = 0
-        cnt = 0
-        for t in Fc[f]:
-            sum+=t/1000
-            cnt+=1
-        if sum > 0:
-            avg = sum/cnt
-            mean_timesc.append(avg)
-    mean_timesc = np.array(mean_timesc)
+    Outputs:
+    mean_times - a list with the mean time differences of each dataset
+    """
 
-    for f in Fu:
-        sum = 0
-        cnt = 0
-        for t in Fu[f]:
-            sum+=t/1000
-            cnt+=1
-        if sum > 0:
-            avg = sum/cnt
-            mean_timesu.append(avg)
+    if workers <= 1 or len(input_files) <= 1:
+        return [dataset_mean_waiting_times(input_file) for input_file in input_files]
 
-    mean_timesu = np.array(mean_timesu)
+    from concurrent.futures import ProcessPoolExecutor
 
-    return mean_timesc, mean_timesu
+    with ProcessPoolExecutor(max_workers=min(workers, len(input_files))) as executor:
+        return list(executor.map(dataset_mean_waiting_times, input_files))
 
 
+def country_datasets(country):
+
+    """
+    Returns the names of the coordinated and uncoordinated datasets of a country.
+    """
+
+    if country == "brazil":
+        return country + "_1", country + "_2"
+    return country + "_coordinated", country + "_uncoordinated"
+
+
+def compare_waiting_times(mean_timesc, mean_timesu):
+
+    """
+    This function compares the mean waiting times of a coordinated and an uncoordinated dataset with a two-sample
+    Kolmogorov-Smirnov test.
+
+    Inputs:
+    mean_timesc - the mean time differences for the coordinated data
+    mean_timesu - the mean time differences for the uncoordinated data
+
+    Outputs:
+    result - a dictionary with the test statistic, its p-value, the number of transitions and the average wait times
+    (in seconds, as printed by this script)
+    """
+
+    ks_statistic, p_value = ks_2samp(mean_timesc, mean_timesu)
+
+    return {
+        "ks_statistic": float(ks_statistic),
+        "p_value": float(p_value),
+        "n_coordinated": len(mean_timesc),
+        "n_uncoordinated": len(mean_timesu),
+        "mean_coordinated": float(np.mean(mean_timesc) * 1000),
+        "mean_uncoordinated": float(np.mean(mean_timesu) * 1000),
+    }
+
+
+def compare_countries(data_folder, countries=COUNTRIES, workers=1):
+
+    """
+    This function compares the mean waiting times of the coordinated and uncoordinated datasets of several countries,
+    processing all of their datasets concurrently.
+
+    Inputs:
+    data_folder - the folder containing the .pnml and .xes files
+    countries - the countries to compare
+    workers - the number of processes
+
+    Outputs:
+    results - a list with one result dictionary per country (see compare_waiting_times)
+    mean_times - a dictionary mapping each country to its (coordinated, uncoordinated) mean time differences
+    """
 
-if __name__ == "__main__":
-    from load_config import load_config
     import os
-    import argparse
 
-    config = load_config()
+    datasets = [name for country in countries for name in country_datasets(country)]
+    all_mean_times = map_datasets([os.path.join(data_folder, name) for name in datasets], workers)
 
-    parser = argparse.ArgumentParser(description="Run script for each country.")
-    parser.add_argument("--country", type=str, required=True, choices = ["uae", "brazil", "honduras"], help="Country name (lowercase)")
-    args = parser.parse_args()
+    results = []
+    mean_times = {}
+    for i, country in enumerate(countries):
+        mean_timesc, mean_timesu = all_mean_times[2 * i], all_mean_times[2 * i + 1]
+        mean_times[country] = (mean_timesc, mean_timesu)
 
-    if args.country == "brazil":
-        c_input_file = os.path.join(config['project_root'], "data", args.country + "_1")
-        u_input_file = os.path.join(config['project_root'], "data", args.country + "_2")
-    else:
-        c_input_file = os.path.join(config['project_root'], "data", args.country + "_coordinated")
-        u_input_file = os.path.join(config['project_root'], "data", args.country + "_uncoordinated")
+        result = {"country": country, "coordinated": datasets[2 * i], "uncoordinated": datasets[2 * i + 1]}
+        result.update(compare_waiting_times(mean_timesc, mean_timesu))
+        results.append(result)
+
+    return results, mean_times
 
 
+def plot_waiting_times(mean_timesc, mean_timesu, country, output_path=None):
+
+    """
+    This function plots the histograms of the mean waiting times of a coordinated and an uncoordinated dataset.
 
+    Inputs:
+    mean_timesc - the mean time differences for the coordinated data
+    mean_timesu - the mean time differences for the uncoordinated data
+    country - the country, used in the title
+    output_path - if given, the plot is saved to this file with a non-interactive backend instead of being shown
+    """
 
-    mean_timesc, mean_timesu = calculate_mean_waiting_times(c_input_file, u_input_file)
+    import matplotlib
+    if output_path is not None:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
 
     num_bins1=round(max(mean_timesc)*6)
     num_bins2=round(max(mean_timesu)*6)
@@ -98,23 +259,72 @@ if __name__ == "__main__":
     # Labels and title
     plt.xlabel('Time in seconds')
     plt.ylabel('Density')
-    plt.title('User waiting times in ' + args.country + ' model')
+    plt.title('User waiting times in ' + country + ' model')
     plt.legend()
     plt.grid(axis='y', linestyle='--', alpha=0.7)
     plt.xlim(0, 15) 
     plt.ylim(0, 0.5) 
 
-    # Show the plot
-    plt.show()
+    if output_path is None:
+        # Show the plot
+        plt.show()
+    else:
+        plt.savefig(output_path)
+        plt.close()
+
 
-    ks_statistic, p_value = ks_2samp(mean_timesc, mean_timesu)
-    print(p_value)
 
-    if args.country == "brazil":
-        print("Average wait time in " + args.country + "_1:", np.mean(mean_timesc)*1000)
-        print("Average wait time in " + args.country + "_2:", np.mean(mean_timesu)*1000)
+if __name__ == "__main__":
+    from load_config import load_config
+    import os
+    import argparse
+    import json
+
+    config = load_config()
+
+    parser = argparse.ArgumentParser(description="Run script for each country.")
+    parser.add_argument("--country", type=str, nargs="+", default=None, choices = COUNTRIES, help="Country name (lowercase); several countries are only allowed with --headless (default there: all three)")
+    parser.add_argument("--headless", action="store_true", help="Do not show the plot; print the KS test results and average wait times of every country as JSON")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of datasets processed concurrently")
+    parser.add_argument("--plot", type=str, default=None, help="With --headless, save the histogram of each country to this folder as <country>_waiting_times.png")
+    parser.add_argument("--output", type=str, default=None, help="With --headless, write the JSON results to this file instead of printing them")
+    args = parser.parse_args()
+
+    data_folder = os.path.join(config['project_root'], "data")
+
+    if args.headless:
+        results, mean_times = compare_countries(data_folder, args.country or COUNTRIES, workers=args.workers)
+
+        if args.plot is not None:
+            os.makedirs(args.plot, exist_ok=True)
+            for country, (mean_timesc, mean_timesu) in mean_times.items():
+                plot_waiting_times(mean_timesc, mean_timesu, country, os.path.join(args.plot, country + "_waiting_times.png"))
+
+        if args.output is None:
+            print(json.dumps(results, indent=4))
+        else:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=4)
+
     else:
-        print("Average wait time in " + args.country + " coordinated:", np.mean(mean_timesc)*1000)
-        print("Average wait time in " + args.country + " uncoordinated:", np.mean(mean_timesu)*1000)
+        if args.country is None or len(args.country) != 1:
+            parser.error("exactly one --country is needed unless --headless is given")
+        country = args.country[0]
+
+        c_name, u_name = country_datasets(country)
+        c_input_file = os.path.join(data_folder, c_name)
+        u_input_file = os.path.join(data_folder, u_name)
+
+        mean_timesc, mean_timesu = calculate_mean_waiting_times(c_input_file, u_input_file, workers=args.workers)
+
+        plot_waiting_times(mean_timesc, mean_timesu, country)
 
+        ks_statistic, p_value = ks_2samp(mean_timesc, mean_timesu)
+        print(p_value)
 
+        if country == "brazil":
+            print("Average wait time in " + country + "_1:", np.mean(mean_timesc)*1000)
+            print("Average wait time in " + country + "_2:", np.mean(mean_timesu)*1000)
+        else:
+            print("Average wait time in " + country + " coordinated:", np.mean(mean_timesc)*1000)
+            print("Average wait time in " + country + " uncoordinated:", np.mean(mean_timesu)*1000)
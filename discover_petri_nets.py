@@ -1,47 +1,169 @@
-def discover_petri_nets(file_path):
+def discover_process_tree(log, multi_processing=True):
+    """
+    Discovers a process tree from an event log using the inductive miner (IMf, noise threshold 0.2).
+
+    Inputs:
+    log: an event log, as an EventLog or a DataFrame
+    multi_processing: if True, pm4py uses several processes for the discovery
+
+    Outputs:
+    tree: the process tree
+    """
+    import os
+    import pm4py
+
+    # pm4py's pool has os.cpu_count() - 1 processes, which fails on a single CPU
+    multi_processing = multi_processing and (os.cpu_count() or 1) > 1
+
+    return pm4py.discover_process_tree_inductive(log, noise_threshold=0.2, multi_processing=multi_processing)
+
+
+def discover_petri_net(log, multi_processing=True):
+    """
+    Discovers a Petri net from an event log using the inductive miner with a noise threshold of 0.2.
+
+    Inputs:
+    log: an event log, as an EventLog or a DataFrame
+    multi_processing: if True, pm4py uses several processes for the discovery
+
+    Outputs:
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
+    """
+    import pm4py
+
+    return pm4py.convert_to_petri_net(discover_process_tree(log, multi_processing=multi_processing))
+
+
+def discover_petri_nets(file_path, multi_processing=True):
     """
     Discovers a Petri net using the inductive miner and saves to a .pnml file in the same folder as the event log is located.
+    The process tree the net is converted from is saved next to it as a .ptml file, so that tree-based metrics
+    (see calculate_constructs.py) do not need to mine the log again.
 
     Inputs:
     file_path: path to an event log 
+    multi_processing: if True, pm4py uses several processes for the discovery
+
+    Outputs:
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
     """
     import pm4py
+    from event_log_cache import load_event_log
     print("loading event log...")
-    log = pm4py.read_xes(file_path)
+    log = load_event_log(file_path, as_dataframe=True)
     print("discovering Petri net...")
-    net, im, fm = pm4py.discover_petri_net_inductive(log, noise_threshold=0.2, multi_processing=True)
+    tree = discover_process_tree(log, multi_processing=multi_processing)
+    net, im, fm = pm4py.convert_to_petri_net(tree)
 
     # add path to output for each Petri net
     print("saving Petri net...")
-    split_path = file_path.split(sep='.xes')
-    output_path = split_path[0] + ".pnml"
-    pm4py.write_pnml(net, im, fm, output_path)
+    pm4py.write_ptml(tree, get_ptml_path(file_path))
+    pm4py.write_pnml(net, im, fm, get_pnml_path(file_path))
 
     return net, im, fm
 
 
+def get_pnml_path(file_path):
+    """Returns the path of the Petri net discovered from an event log, next to the log."""
+    split_path = file_path.split(sep='.xes')
+    return split_path[0] + ".pnml"
+
+
+def get_ptml_path(file_path):
+    """Returns the path of the process tree discovered from an event log, next to the log."""
+    split_path = file_path.split(sep='.xes')
+    return split_path[0] + ".ptml"
+
+
+def is_up_to_date(file_path, paths=None):
+    """
+    Checks whether the Petri net and process tree of an event log exist and were written after the log was last modified.
+
+    Inputs:
+    file_path: path to an event log
+    paths: the discovered files to check (default: the .pnml and .ptml files of the log)
+
+    Outputs:
+    True if the log does not need to be discovered again
+    """
+    import os
+
+    if paths is None:
+        paths = [get_pnml_path(file_path), get_ptml_path(file_path)]
+    log_mtime = os.path.getmtime(file_path)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= log_mtime for path in paths)
+
+
+def _discover_to_file(file_path, multi_processing):
+    discover_petri_nets(file_path, multi_processing=multi_processing)
+    return get_pnml_path(file_path)
+
+
+def discover_all(file_paths, workers=None, force=False):
+    """
+    Discovers the Petri nets of several event logs, mining logs concurrently on a process pool.
+
+    At most workers processes mine at the same time: when several logs are mined at once, each one is mined in a
+    single process with pm4py's multi_processing turned off. pm4py's own pool always has os.cpu_count() - 1 processes,
+    so it is only used for a single log when workers allows every CPU. Logs whose .pnml file is up to date are skipped
+    unless force is True.
+
+    Inputs:
+    file_paths: paths to event logs
+    workers: the maximum number of processes used (default: the number of CPUs)
+    force: if True, rediscover every net
+
+    Outputs:
+    pnml_paths: the paths of the nets that were discovered
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    pending = []
+    for file_path in file_paths:
+        if not force and is_up_to_date(file_path):
+            print("skipping {}, its Petri net and process tree are up to date".format(file_path))
+        else:
+            pending.append(file_path)
+
+    if workers <= 1 or len(pending) <= 1:
+        multi_processing = workers >= (os.cpu_count() or 1)
+        return [_discover_to_file(file_path, multi_processing) for file_path in pending]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+        futures = [executor.submit(_discover_to_file, file_path, False) for file_path in pending]
+        return [future.result() for future in futures]
+
+
 if __name__ == "__main__":
     from load_config import load_config
     import os
+    import glob
     import argparse
-    import pm4py
 
     config = load_config()
 
-    parser = argparse.ArgumentParser(description="Discover Petri net from event log.")
-    parser.add_argument("--log", type=str, required=True, choices=["brazil_1.xes", "brazil_2.xes", "honduras_coordinated.xes", "honduras_uncoordinated.xes", "uae_coordinated.xes", "uae_uncoordinated.xes"], help="Event log filename (relative to project root)")
+    parser = argparse.ArgumentParser(description="Discover Petri nets from event logs.")
+    parser.add_argument("--log", type=str, nargs="+", default=["*.xes"], help="Event log filenames or glob patterns, relative to the data folder (default: all .xes files)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Maximum number of logs mined at once, each in its own process; a single log only uses pm4py's multiprocessing when this is the number of CPUs (default: number of CPUs)")
+    parser.add_argument("--force", action="store_true", help="Rediscover nets that are already up to date")
     args = parser.parse_args()
 
-    # Construct dataset path
-    dataset_path = os.path.join(config["project_root"], "data", args.log)
-
-    if not os.path.exists(dataset_path):
-        raise FileNotFoundError(f"Dataset not found: {dataset_path}")
-    
-    split_path = args.log.split(sep=".xes")
-
-    output_path = os.path.join(config['project_root'], "data", split_path[0] + ".pnml")
+    data_folder = os.path.join(config["project_root"], "data")
 
-    net, im, fm = discover_petri_nets(dataset_path)
+    # Construct dataset paths
+    dataset_paths = []
+    for pattern in args.log:
+        matches = sorted(path for path in glob.glob(os.path.join(data_folder, pattern)) if path.endswith(".xes"))
+        if not matches:
+            raise FileNotFoundError(f"Dataset not found: {os.path.join(data_folder, pattern)}")
+        dataset_paths.extend(path for path in matches if path not in dataset_paths)
 
-    pm4py.write_pnml(net, im, fm, output_path)
+    discover_all(dataset_paths, workers=args.workers, force=args.force)
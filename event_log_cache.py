@@ -0,0 +1,276 @@
+import hashlib
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# bump when the layout of the cache files changes
+CACHE_VERSION = 1
+
+LogColumns = namedtuple("LogColumns", ["case_names", "case_index", "activity_names", "activity_codes", "timestamps"])
+LogColumns.__doc__ = """
+Columnar form of an event log, with one array entry per event in log order.
+
+Attributes:
+case_names: list of the case identifiers, one per trace (None for traces without a concept:name)
+case_index: array with the position of each event's trace in the log
+activity_names: list of the distinct activities, in order of first appearance
+activity_codes: array with the index of each event's activity in activity_names
+timestamps: int64 array of event timestamps in microseconds since the epoch
+"""
+
+
+def log_to_columns(log):
+
+    """
+    Flattens an event log into one array entry per event, in log order
+
+    Inputs:
+    log: the event log
+
+    Outputs:
+    columns: the LogColumns of the log
+    """
+
+    codes = {}
+    case_names = []
+    case_index = []
+    activity_codes = []
+    timestamps = []
+
+    aware_epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    naive_epoch = datetime(1970, 1, 1)
+    microsecond = timedelta(microseconds=1)
+
+    for i, trace in enumerate(log):
+        case_names.append(trace.attributes.get('concept:name'))
+        for event in trace:
+            name = event['concept:name']
+            code = codes.get(name)
+            if code is None:
+                code = codes[name] = len(codes)
+            timestamp = event['time:timestamp']
+            epoch = naive_epoch if timestamp.tzinfo is None else aware_epoch
+
+            case_index.append(i)
+            activity_codes.append(code)
+            timestamps.append((timestamp - epoch) // microsecond)
+
+    return LogColumns(case_names, np.array(case_index, dtype=np.int64), list(codes),
+                      np.array(activity_codes, dtype=np.int64), np.array(timestamps, dtype=np.int64))
+
+
+def get_cache_path(file_path):
+    """Returns the path of the cache file kept next to a source file."""
+    return file_path + ".cache.npz"
+
+
+def file_fingerprint(file_path):
+    """
+    Returns the modification time, size and SHA-256 of a file.
+
+    Inputs:
+    file_path: path to a file
+
+    Outputs:
+    fingerprint: a dictionary with the keys "mtime_ns", "size" and "sha256"
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest.hexdigest()}
+
+
+def read_cache(file_path):
+    """
+    Reads the cache file of a source file if it is still valid.
+
+    The cache is valid if it was written with the current CACHE_VERSION and the source has the same modification
+    time and size. If only the modification time changed, the source is hashed and the cache is kept (and its
+    recorded modification time refreshed) when the contents are unchanged.
+
+    Inputs:
+    file_path: path to the source file
+
+    Outputs:
+    arrays: a dictionary of the arrays stored in the cache, or None if there is no valid cache
+    """
+    cache_path = get_cache_path(file_path)
+    if not os.path.exists(cache_path):
+        return None
+
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            arrays = {key: data[key] for key in data.files}
+    except (OSError, ValueError):
+        return None
+
+    if int(arrays.get("cache_version", -1)) != CACHE_VERSION:
+        return None
+
+    stat = os.stat(file_path)
+    if int(arrays["source_size"]) != stat.st_size:
+        return None
+
+    if int(arrays["source_mtime_ns"]) != stat.st_mtime_ns:
+        fingerprint = file_fingerprint(file_path)
+        if str(arrays["source_sha256"]) != fingerprint["sha256"]:
+            return None
+        arrays["source_mtime_ns"] = np.int64(fingerprint["mtime_ns"])
+        write_cache(file_path, arrays, fingerprint)
+
+    return arrays
+
+
+def write_cache(file_path, arrays, fingerprint=None):
+    """
+    Writes arrays to the cache file of a source file, together with the fingerprint of the source.
+
+    Inputs:
+    file_path: path to the source file
+    arrays: a dictionary of arrays to store
+    fingerprint: the file_fingerprint of the source, computed if not given
+    """
+    if fingerprint is None:
+        fingerprint = file_fingerprint(file_path)
+
+    arrays = dict(arrays)
+    arrays["cache_version"] = np.int64(CACHE_VERSION)
+    arrays["source_mtime_ns"] = np.int64(fingerprint["mtime_ns"])
+    arrays["source_size"] = np.int64(fingerprint["size"])
+    arrays["source_sha256"] = np.array(fingerprint["sha256"])
+
+    # write to a temporary file first so that an interrupted run never leaves a truncated cache behind
+    cache_path = get_cache_path(file_path)
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+def read_log_columns(file_path):
+    """
+    Reads an XES event log in columnar form, parsing the XES only if there is no valid cache.
+
+    Events are sorted by timestamp within each trace, as with the TIMESTAMP_SORT parameter of the ITERPARSE importer.
+
+    Inputs:
+    file_path: path to an event log
+
+    Outputs:
+    columns: the LogColumns of the log
+    tz_aware: True if the timestamps in the log carry a timezone (they are stored in UTC)
+    """
+    arrays = read_cache(file_path)
+
+    if arrays is None:
+        from pm4py.objects.log.importer.xes import importer as xes_importer
+
+        fingerprint = file_fingerprint(file_path)
+        variant = xes_importer.Variants.ITERPARSE
+        parameters = {variant.value.Parameters.TIMESTAMP_SORT: True}
+        log = xes_importer.apply(file_path, variant=variant, parameters=parameters)
+
+        columns = log_to_columns(log)
+        tz_aware = any(event['time:timestamp'].tzinfo is not None for trace in log for event in trace)
+
+        arrays = {
+            "case_names": np.array(["" if name is None else name for name in columns.case_names], dtype=str),
+            "case_named": np.array([name is not None for name in columns.case_names], dtype=bool),
+            "case_index": columns.case_index.astype(np.int32),
+            "activity_names": np.array(columns.activity_names, dtype=str),
+            "activity_codes": columns.activity_codes.astype(np.int32),
+            "timestamps": columns.timestamps,
+            "tz_aware": np.bool_(tz_aware),
+        }
+        write_cache(file_path, arrays, fingerprint)
+
+    columns = LogColumns(
+        case_names=[name if named else None for name, named in zip(arrays["case_names"].tolist(), arrays["case_named"].tolist())],
+        case_index=arrays["case_index"].astype(np.int64),
+        activity_names=arrays["activity_names"].tolist(),
+        activity_codes=arrays["activity_codes"].astype(np.int64),
+        timestamps=arrays["timestamps"].astype(np.int64),
+    )
+    return columns, bool(arrays["tz_aware"])
+
+
+def columns_to_event_log(columns, tz_aware=False):
+    """
+    Builds a pm4py EventLog from the columnar form of a log.
+
+    Inputs:
+    columns: the LogColumns of a log
+    tz_aware: if True, timestamps are given the UTC timezone
+
+    Outputs:
+    log: the event log
+    """
+    from pm4py.objects.log.obj import Event, EventLog, Trace
+
+    timestamps = columns.timestamps.astype("datetime64[us]").tolist()
+    if tz_aware:
+        timestamps = [timestamp.replace(tzinfo=timezone.utc) for timestamp in timestamps]
+
+    names = columns.activity_names
+    activities = [names[code] for code in columns.activity_codes.tolist()]
+
+    # start offset of each trace's events
+    offsets = np.searchsorted(columns.case_index, np.arange(len(columns.case_names) + 1)).tolist()
+
+    log = EventLog()
+    for i, case_name in enumerate(columns.case_names):
+        trace = Trace(attributes={} if case_name is None else {'concept:name': case_name})
+        for j in range(offsets[i], offsets[i + 1]):
+            trace.append(Event({'concept:name': activities[j], 'time:timestamp': timestamps[j]}))
+        log.append(trace)
+
+    return log
+
+
+def columns_to_dataframe(columns, tz_aware=False):
+    """
+    Builds a pandas DataFrame in the pm4py format (concept:name, time:timestamp, case:concept:name)
+    from the columnar form of a log.
+
+    Inputs:
+    columns: the LogColumns of a log
+    tz_aware: if True, timestamps are given the UTC timezone
+
+    Outputs:
+    df: the event log as a DataFrame
+    """
+    import pandas as pd
+
+    timestamps = pd.to_datetime(columns.timestamps, unit="us", utc=tz_aware)
+    # traces without a case identifier get a missing value, as in pm4py.read_xes
+    case_names = np.array([np.nan if name is None else name for name in columns.case_names], dtype=object)
+
+    return pd.DataFrame({
+        'concept:name': np.array(columns.activity_names, dtype=object)[columns.activity_codes],
+        'time:timestamp': timestamps,
+        'case:concept:name': case_names[columns.case_index],
+    })
+
+
+def load_event_log(file_path, as_dataframe=False):
+    """
+    Loads an XES event log through its columnar cache.
+
+    The first time a log is loaded the XES is parsed and a compact cache (case IDs, activity codes and int64
+    timestamps) is written next to it. Later loads read the cache, which is rebuilt when the XES changes.
+
+    Inputs:
+    file_path: path to an event log
+    as_dataframe: if True, return a pandas DataFrame instead of an EventLog
+
+    Outputs:
+    log: the event log, with events sorted by timestamp within each trace
+    """
+    columns, tz_aware = read_log_columns(file_path)
+
+    if as_dataframe:
+        return columns_to_dataframe(columns, tz_aware)
+    return columns_to_event_log(columns, tz_aware)
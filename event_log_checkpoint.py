@@ -0,0 +1,243 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from event_log_pipeline import CASE, ACTIVITY, TIMESTAMP
+
+# bump when the layout of the checkpoint changes
+CHECKPOINT_VERSION = 1
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# number of segments above which the generators compact a checkpoint, so that loading it stays proportional to the
+# state rather than to the number of runs
+MAX_SEGMENTS = 16
+
+
+def _truncate_partial_line(file_path):
+    """
+    Removes a partially written last line from a file, so that the next line appended to it starts on a line of its own.
+    """
+    if not os.path.exists(file_path):
+        return
+
+    with open(file_path, "rb+") as f:
+        # read backwards in blocks until the last newline is found
+        size = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            block_start = max(position - 65536, 0)
+            f.seek(block_start)
+            block = f.read(position - block_start)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                position = block_start + newline + 1
+                break
+            position = block_start
+        if position < size:
+            f.truncate(position)
+
+
+class EventLogCheckpoint:
+    """
+    Append-only checkpoint of the per-case state used to generate an event log incrementally.
+
+    The checkpoint is a folder of segments. Every update writes the new state of the cases it changed to a new .npz
+    segment and then appends one line to manifest.jsonl, recording the segment, how far each source file has been
+    read and the next event sequence number. Existing files are never rewritten, so an interrupted update leaves the
+    previous checkpoint intact. When loading, the rows of each case are taken from the last segment that contains it.
+
+    Attributes:
+    path: the folder of the checkpoint
+    settings: the settings the state was built with (e.g. trim_length); a checkpoint with other settings is discarded
+    columns: the columns of the state
+    state: DataFrame with the current state of every case
+    sources: dict mapping each source file to the byte offset up to which it has been read
+    next_seq: the sequence number of the next event read
+    segments: the number of segments listed in the manifest
+    """
+
+    def __init__(self, path, settings, by=()):
+        self.path = path
+        # compare settings in their JSON form so that tuples and lists are treated alike
+        self.settings = json.loads(json.dumps(settings))
+        self.columns = list(by) + [CASE, ACTIVITY, TIMESTAMP, 'seq']
+        self._reset_state()
+        self._load()
+
+    def _reset_state(self):
+        import pandas as pd
+
+        self.state = pd.DataFrame({column: [] for column in self.columns})
+        self.sources = {}
+        self.next_seq = 0
+        self.segments = 0
+
+    def _load(self):
+        import pandas as pd
+
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return
+
+        entries = []
+        with open(manifest_path, "r") as f:
+            for line in f:
+                # a partially written last line belongs to an update that did not finish, and is removed by the next
+                # append
+                if not line.endswith("\n"):
+                    break
+                entries.append(json.loads(line))
+
+        if not entries or any(entry.get("version") != CHECKPOINT_VERSION or entry.get("settings") != self.settings
+                              for entry in entries):
+            print("checkpoint settings changed, rebuilding from scratch...")
+            self.reset()
+            return
+
+        segments = []
+        for number, entry in enumerate(entries):
+            segment = self._read_segment(entry["segment"])
+            segment["segment"] = number
+            segments.append(segment)
+
+        df = pd.concat(segments, ignore_index=True)
+        keys = self.columns[:-3]
+        latest = df.groupby(keys, sort=False, observed=True)["segment"].transform("max")
+        df = df[df["segment"].to_numpy() == latest.to_numpy()].drop(columns="segment")
+
+        self.state = df.sort_values(by=[TIMESTAMP, 'seq'], kind='stable').reset_index(drop=True)
+        self.sources = entries[-1]["sources"]
+        self.next_seq = entries[-1]["next_seq"]
+        self.segments = len(entries)
+
+    def _read_segment(self, name):
+        import pandas as pd
+
+        with np.load(os.path.join(self.path, name), allow_pickle=False) as data:
+            return pd.DataFrame({column: data["column_{}".format(i)] for i, column in enumerate(self.columns)})
+
+    def _write_segment(self, df):
+        # number segments after the last one on disk, which may be more than the manifest lists after a compaction
+        numbers = [int(name[8:14]) for name in os.listdir(self.path) if name.startswith("segment_") and name.endswith(".npz")
+                   and name[8:14].isdigit()]
+        name = "segment_{:06d}.npz".format(max(numbers, default=-1) + 1)
+        arrays = {}
+        for i, column in enumerate(self.columns):
+            values = df[column]
+            if column == ACTIVITY:
+                arrays["column_{}".format(i)] = np.asarray(values.astype(str), dtype=str)
+            elif column == TIMESTAMP:
+                arrays["column_{}".format(i)] = values.to_numpy(dtype="datetime64[ns]")
+            else:
+                arrays["column_{}".format(i)] = values.to_numpy(dtype=np.int64)
+
+        tmp_path = os.path.join(self.path, name + ".tmp.npz")
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, os.path.join(self.path, name))
+        return name
+
+    def reset(self):
+        """Deletes the checkpoint, so that the log is rebuilt from the start of every source."""
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        self._reset_state()
+
+    def check_sources(self):
+        """
+        Resets the checkpoint if a source file it has read was removed or shortened, as its events cannot be taken back.
+
+        Only the size of each file is compared with the offset read so far; the bytes already read are not hashed, as
+        that would mean reading every file again on each run. A file edited in place without getting shorter is not
+        detected, and the checkpoint has to be deleted by hand.
+        """
+        for file_path, offset in self.sources.items():
+            if not os.path.exists(file_path) or os.path.getsize(file_path) < offset:
+                print("{} changed since the last run, rebuilding from scratch...".format(file_path))
+                self.reset()
+                return
+
+    def append(self, updated, sources, next_seq):
+        """
+        Records an update: the new state of the changed cases, the new source offsets and the next sequence number.
+
+        Inputs:
+        updated: DataFrame with the new state of every case that changed (see event_log_pipeline.update_case_state)
+        sources: dict mapping source files to their new offsets (other sources keep their offsets)
+        next_seq: the sequence number of the next event read
+        """
+        import pandas as pd
+
+        os.makedirs(self.path, exist_ok=True)
+        updated = updated.loc[:, self.columns]
+
+        new_sources = dict(self.sources)
+        new_sources.update(sources)
+
+        entry = {
+            "version": CHECKPOINT_VERSION,
+            "settings": self.settings,
+            "segment": self._write_segment(updated),
+            "sources": new_sources,
+            "next_seq": int(next_seq),
+        }
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        _truncate_partial_line(manifest_path)
+        with open(manifest_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        keys = self.columns[:-3]
+        changed = pd.MultiIndex.from_frame(updated[keys]).unique()
+        state = self.state[~pd.MultiIndex.from_frame(self.state[keys]).isin(changed)]
+        if len(updated) > 0:
+            state = pd.concat([state, updated], ignore_index=True) if len(state) > 0 else updated
+            state = state.sort_values(by=[TIMESTAMP, 'seq'], kind='stable')
+        self.state = state.reset_index(drop=True)
+
+        self.sources = new_sources
+        self.next_seq = int(next_seq)
+        self.segments += 1
+
+    def compact_if_needed(self, max_segments=None):
+        """
+        Compacts the checkpoint if its manifest lists more than max_segments segments.
+
+        Inputs:
+        max_segments: the number of segments allowed before compacting (default: MAX_SEGMENTS)
+        """
+        if max_segments is None:
+            max_segments = MAX_SEGMENTS
+        if self.segments > max_segments:
+            print("compacting checkpoint of {} segments...".format(self.segments))
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites the checkpoint as a single segment holding the current state.
+
+        The new manifest replaces the old one atomically before the old segments are deleted.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        entry = {
+            "version": CHECKPOINT_VERSION,
+            "settings": self.settings,
+            "segment": self._write_segment(self.state),
+            "sources": self.sources,
+            "next_seq": self.next_seq,
+        }
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        with open(manifest_path + ".tmp", "w") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+        for name in os.listdir(self.path):
+            if name.startswith("segment_") and name != entry["segment"]:
+                os.remove(os.path.join(self.path, name))
+        self.segments = 1
@@ -0,0 +1,144 @@
+CASE = 'case:concept:name'
+ACTIVITY = 'concept:name'
+TIMESTAMP = 'time:timestamp'
+
+
+def normalise_userids(userids):
+    """
+    This function turns raw user IDs into activity names, 'u' followed by the ID without '+' and '=' characters.
+
+    Each distinct ID is normalised once with vectorized string operations and the result is a pandas Categorical, so
+    every row only stores a small integer code and rows of the same user share one string object, down to the events
+    of the EventLog.
+
+    Inputs:
+    userids: a Series of user IDs (missing IDs, NaN or None, become 'unan', as NaN does with astype('str'))
+
+    Outputs:
+    activities: a categorical Series of activity names with the index of userids
+    """
+    import pandas as pd
+
+    codes, uniques = pd.factorize(userids, use_na_sentinel=False)
+    uniques = pd.Index(uniques, dtype=object)
+    names = 'u' + uniques.where(uniques.notna(), 'nan').astype('str').str.replace('[+=]', '', regex=True)
+
+    # different raw IDs can normalise to the same name
+    name_codes, categories = pd.factorize(names)
+    return pd.Series(pd.Categorical.from_codes(name_codes[codes], categories), index=userids.index)
+
+
+def earliest_events(df, by=()):
+    """
+    This function keeps only the earliest event of each activity within each case.
+
+    Inputs:
+    df: a DataFrame with case:concept:name, concept:name and time:timestamp columns
+    by: extra columns that split the DataFrame into independent logs (e.g. a cohort column)
+
+    Outputs:
+    earliest_df: the earliest events, sorted by time
+    """
+    idx = df.groupby(list(by) + [CASE, ACTIVITY], sort=False, observed=True)[TIMESTAMP].idxmin()
+    earliest_df = df.loc[idx]
+    return earliest_df.sort_values(by=TIMESTAMP, kind='stable')
+
+
+def trim_and_truncate(df, trim_length, log_length, min_length=2, by=(), presorted=False):
+    """
+    This function selects the events that make up the final event log, entirely in pandas.
+
+    Events are sorted by time, each case is trimmed to its first trim_length events, cases with fewer than
+    min_length events are removed and the first log_length cases (in order of their first event) are kept.
+    This matches converting the whole DataFrame to an EventLog, trimming each trace, applying filter_case_size and
+    taking the first log_length traces, but only the selected rows are left to convert.
+
+    If by is given, the rows of each value of the by columns are treated as a separate log, so several logs are
+    selected in one pass.
+
+    Inputs:
+    df: a DataFrame with case:concept:name, concept:name and time:timestamp columns
+    trim_length: length to trim each trace to
+    log_length: desired number of traces
+    min_length: minimum length of a trace
+    by: extra columns that split the DataFrame into independent logs (e.g. a cohort column)
+    presorted: if True, df is already sorted by time and is not sorted again
+
+    Outputs:
+    short_df: the selected events, sorted by time
+    """
+    import pandas as pd
+
+    keys = list(by) + [CASE]
+    if not presorted:
+        df = df.sort_values(by=TIMESTAMP, kind='stable')
+
+    # position of each event within its case, then trim
+    position = df.groupby(keys, sort=False, observed=True).cumcount()
+    df = df[position.to_numpy() < trim_length]
+
+    # remove short traces
+    size = df.groupby(keys, sort=False, observed=True)[TIMESTAMP].transform('size')
+    df = df[size.to_numpy() >= min_length]
+
+    # select the first x traces
+    if not by:
+        selected = df[CASE].drop_duplicates().iloc[:log_length]
+        return df[df[CASE].isin(selected)]
+
+    cases = df[keys].drop_duplicates()
+    selected = cases[cases.groupby(list(by), sort=False, observed=True).cumcount().to_numpy() < log_length]
+    return df[pd.MultiIndex.from_frame(df[keys]).isin(pd.MultiIndex.from_frame(selected))]
+
+
+def dataframe_to_event_log(df):
+    """
+    This function converts a DataFrame of events to an EventLog, with one trace per case in order of first appearance.
+
+    Inputs:
+    df: a DataFrame with case:concept:name, concept:name and time:timestamp columns, sorted by time
+
+    Outputs:
+    log: the event log
+    """
+    from pm4py.objects.conversion.log import converter as log_converter
+
+    return log_converter.apply(df, variant=log_converter.Variants.TO_EVENT_LOG)
+
+
+def update_case_state(state, events, trim_length, dedup=False, by=()):
+    """
+    This function merges new events into the per-case state kept by incremental log generation.
+
+    The state of a case is its trim_length earliest events (with dedup, the earliest event of each of its
+    trim_length earliest activities). Keeping only these is enough: an event that is not among them can never
+    re-enter the trimmed trace when later events arrive. Events with equal timestamps are ordered by the seq column,
+    the order in which they were read.
+
+    Inputs:
+    state: the current state, a DataFrame with case:concept:name, concept:name, time:timestamp and seq columns
+    events: the new events, with the same columns
+    trim_length: length to trim each trace to
+    dedup: if True, only the earliest event of each activity within each case is kept
+    by: extra columns that split the events into independent logs (e.g. a cohort column)
+
+    Outputs:
+    updated: the new state of the cases that have new events, sorted by time and seq
+    """
+    import pandas as pd
+
+    keys = list(by) + [CASE]
+    affected = pd.MultiIndex.from_frame(events[keys]).unique()
+    state = state[pd.MultiIndex.from_frame(state[keys]).isin(affected)]
+
+    # a common column order and timestamp unit, as the state may have been read back from a checkpoint
+    columns = keys + [ACTIVITY, TIMESTAMP, 'seq']
+    frames = [frame.loc[:, columns].astype({TIMESTAMP: 'datetime64[ns]'}) for frame in (state, events) if len(frame) > 0]
+    if not frames:
+        return events.loc[:, columns]
+    df = pd.concat(frames, ignore_index=True).sort_values(by=[TIMESTAMP, 'seq'], kind='stable')
+    if dedup:
+        df = df.drop_duplicates(subset=keys + [ACTIVITY], keep='first')
+
+    position = df.groupby(keys, sort=False, observed=True).cumcount()
+    return df[position.to_numpy() < trim_length]
@@ -1,21 +1,171 @@
 import numpy as np
+import weakref
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from pm4py.objects.log.obj import EventLog
 from pm4py.algo.conformance.tokenreplay import algorithm as token_replay
 from tqdm import tqdm
+from petri_net_index import get_net_index
+from event_log_cache import LogColumns, log_to_columns
 
-def generate_P(log, net, im, fm):
+def get_trace_variants(log):
 
     """
-    Generates the dictionary P containing probabilities of transitioning to some transition
+    Groups the traces of an event log by their sequence of activities
+
+    Inputs:
+    log: the event log
+
+    Outputs:
+    variants: a list of (trace, frequency) pairs, one per distinct activity sequence, in order of first appearance.
+    The trace is the first trace in the log with that sequence.
+    """
+
+    variants = {}
+
+    for trace in log:
+        key = tuple(event['concept:name'] for event in trace)
+        if key in variants:
+            variants[key][1] += 1
+        else:
+            variants[key] = [trace, 1]
+
+    return [(trace, frequency) for trace, frequency in variants.values()]
+
+
+def replay_variants(variants, net, im, fm):
+
+    """
+    Replays trace variants on a Petri net in a single token replay call and counts the activated transitions
+
+    Inputs:
+    variants: a list of (trace, frequency) pairs as returned by get_trace_variants
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
+
+    Outputs:
+    counts: a dictionary mapping transition names to the number of times they were activated by perfectly fitting
+    traces, with each variant weighted by its frequency
+    """
+
+    counts = {}
+
+    if len(variants) == 0:
+        return counts
+
+    variant_log = EventLog([trace for trace, _ in variants])
+    fitness = token_replay.apply(variant_log, net, im, fm)
+
+    for (_, frequency), result in zip(variants, fitness):
+        if result['trace_fitness'] == 1.0:
+            for transition in result['activated_transitions']:
+                counts[transition.name] = counts.get(transition.name, 0) + frequency
+
+    return counts
+
+
+def replay_variant_counts(variants, net, im, fm):
+
+    """
+    Replays trace variants on a Petri net in a single token replay call and counts the activated transitions of each
+    variant separately
+
+    Inputs:
+    variants: a list of (trace, frequency) pairs as returned by get_trace_variants
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
+
+    Outputs:
+    counts: int64 array with one row per variant and one column per transition (in the order of the net's NetArrays),
+    counting how often a single trace of the variant activates each transition. Variants that do not fit perfectly
+    have a row of zeros
+    """
+
+    index = get_net_index(net)
+    counts = np.zeros((len(variants), len(index.transitions)), dtype=np.int64)
+
+    if len(variants) == 0:
+        return counts
+
+    variant_log = EventLog([trace for trace, _ in variants])
+    fitness = token_replay.apply(variant_log, net, im, fm)
+
+    for row, result in zip(counts, fitness):
+        if result['trace_fitness'] == 1.0:
+            for transition in result['activated_transitions']:
+                row[index.transition_id[transition]] += 1
+
+    return counts
+
+
+# the Petri net held by each worker process of a parallel replay, set once by _init_replay_worker
+_worker_net = None
+
+
+def _init_replay_worker(net, im, fm):
+    global _worker_net
+    _worker_net = (net, im, fm)
+
+
+def _replay_shard(variants):
+    net, im, fm = _worker_net
+    return replay_variants(variants, net, im, fm)
+
+
+def replay_variants_parallel(variants, net, im, fm, workers):
+
+    """
+    Replays trace variants on a Petri net across a pool of worker processes
+
+    The variants are split into one contiguous shard per worker. The net and markings are sent to each worker once
+    when it starts, and the counts of the shards are added up in shard order, so the result is the same as
+    replay_variants on the whole list.
+
+    Inputs:
+    variants: a list of (trace, frequency) pairs as returned by get_trace_variants
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
+    workers: the number of worker processes
+
+    Outputs:
+    counts: a dictionary mapping transition names to their weighted activation counts
+    """
+
+    shard_size = -(-len(variants) // workers)
+    shards = [variants[i:i + shard_size] for i in range(0, len(variants), shard_size)]
+
+    counts = {}
+
+    if len(shards) == 0:
+        return counts
+
+    with ProcessPoolExecutor(max_workers=len(shards), initializer=_init_replay_worker, initargs=(net, im, fm)) as executor:
+        for shard_counts in executor.map(_replay_shard, shards):
+            for name in shard_counts:
+                counts[name] = counts.get(name, 0) + shard_counts[name]
+
+    return counts
+
+
+def generate_transition_frequencies(log, net, im, fm, batch=True, workers=None):
+
+    """
+    Counts how often each transition is activated when replaying the perfectly fitting traces of the log
 
     Inputs:
     log: the event log
     net: the Petri net discovered from the event log
     im: the initial marking
     fm: the final marking
+    batch: if True, each distinct trace variant is replayed once in a single token replay call and its counts are
+    multiplied by its frequency. If False, every trace is replayed on its own
+    workers: if greater than 1, the variants are replayed across this many worker processes (batch mode only)
 
     Outputs:
-    P: the dictionary containing transition probabilities
+    freq: a dictionary mapping every transition name to its activation count
     """
 
     keys = [t.name for t in net.transitions]
@@ -23,6 +173,16 @@ def generate_P(log, net, im, fm):
     # initialise the frequency dict
     freq = {key: 0 for key in keys}
 
+    if batch:
+        variants = get_trace_variants(log)
+        if workers is not None and workers > 1:
+            counts = replay_variants_parallel(variants, net, im, fm, workers)
+        else:
+            counts = replay_variants(variants, net, im, fm)
+        for name in counts:
+            freq[name] += counts[name]
+        return freq
+
     for trace in tqdm(log):
         # find fitness of trace to petri net
         trace_log = EventLog()
@@ -37,14 +197,35 @@ def generate_P(log, net, im, fm):
             for transition in activated_transitions:
                 label = transition.name
                 freq[label] += 1
-    
 
-    places = [p for p in net.places]
+    return freq
+
+
+def generate_P(log, net, im, fm, batch=True, workers=None):
+
+    """
+    Generates the dictionary P containing probabilities of transitioning to some transition
+
+    Inputs:
+    log: the event log
+    net: the Petri net discovered from the event log
+    im: the initial marking
+    fm: the final marking
+    batch: if True, replay each distinct trace variant once (see generate_transition_frequencies)
+    workers: the number of worker processes used to replay the variants (see generate_transition_frequencies)
+
+    Outputs:
+    P: the dictionary containing transition probabilities
+    """
+
+    freq = generate_transition_frequencies(log, net, im, fm, batch=batch, workers=workers)
+
+    index = get_net_index(net)
 
     P = freq
 
-    for place in places:
-        outgoing_transitions = [arc.target for arc in net.arcs if arc.source == place]
+    for place in index.places:
+        outgoing_transitions = index.place_postset[place]
         
         # find number of output transitions per place
         total = 0
@@ -62,161 +243,558 @@ def generate_P(log, net, im, fm):
     return P
 
 
-def find_previous_transitions(net, current_transition, visited_transitions=None, visited_places=None):
+class _PreviousTransitionSearch:
 
     """
-    Finds the previous possible non-silent transitions from some starting transition
+    Iterative search for the nearest non-silent predecessors of a transition
 
-    Inputs:
-    net: a Petri net
-    current_transition: the transition to find all previous transitions from
+    Each call of the search on a transition is run as a generator frame on an explicit stack, so deep chains of
+    silent transitions cannot hit Python's recursion limit. Frames visit places and transitions in the same order as
+    a depth-first recursion would. Nodes are handled by their integer IDs in the index's NetArrays.
 
-    Outputs:
-    transition_list: a list of previous possible transitions
+    A frame only depends on its transition and on the visited nodes, which only grow. Re-entering a transition that
+    is still on the stack with no node visited since would repeat that frame forever (the recursive search never
+    returned in that case), so such a call is skipped and adds no predecessors.
     """
-    if visited_transitions is None:
-        visited_transitions = set()
-    if visited_places is None:
-        visited_places = set()
 
-    visited_transitions.add(current_transition)
-    
-    transition_list = []
-    
-    while len(transition_list) == 0:
+    def __init__(self, graph, visited_transitions, visited_places):
+        self.graph = graph
+        self.visited = [False] * len(graph["preset"])
+        self.visit_order = []
+        self.active = set()
+
+        for node in visited_transitions:
+            if node in graph["node_id"]:
+                self.visited[graph["node_id"][node]] = True
+        for node in visited_places:
+            if node in graph["node_id"]:
+                self.visited[graph["node_id"][node]] = True
+
+    def _visit(self, node):
+        if not self.visited[node]:
+            self.visited[node] = True
+            self.visit_order.append(node)
+
+    def _frame(self, current_transition):
+        preset = self.graph["preset"]
+        silent = self.graph["silent"]
+        visited = self.visited
+
+        state = (current_transition, len(self.visit_order))
+        self.active.add(state)
+        self._visit(current_transition)
+
+        transition_list = []
+
         # find associated places for the current transition
-        places = [arc.source for arc in net.arcs if arc.target == current_transition]
+        places = preset[current_transition]
 
-        # break while loop if no more previous transitions
-        if len(places) == 0 or places[0].name == 'source':
-            break
+        if len(places) == 0 or places[0] == self.graph["source"]:
+            pass
 
         # handle synchronised transitions (multiple places)
-        if len(places) > 1:
+        elif len(places) > 1:
             synchronised_transitions = []
             for place in places:
-                input_transitions = [arc.source for arc in net.arcs if arc.target == place]
+                input_transitions = preset[place]
 
                 for t in input_transitions:
-                    visited_transitions.add(t)
-                visited_places.add(place)
+                    self._visit(t)
+                self._visit(place)
 
                 for t in input_transitions:
-                    if t.label is not None:
+                    if not silent[t]:
                         synchronised_transitions.append(t)
-                    else:
-                        synchronised_transitions.extend(find_previous_transitions(net, t, visited_transitions, visited_places))
+                    elif (t, len(self.visit_order)) not in self.active:
+                        synchronised_transitions.extend((yield t))
 
             flat_synchronised_transitions = [item for sublist in synchronised_transitions for item in (sublist if isinstance(sublist, list) else [sublist])]
 
             transition_list.append(flat_synchronised_transitions)
-            break
 
         # explore previous transitions
-        found_transition = False
-        for place in places:
-            if place in visited_places:
-                continue  # skip if the place has already been visited
-            
-            visited_places.add(place)  # mark the place as visited
-            
-            input_transitions = [arc.source for arc in net.arcs if arc.target == place]
-            
-            for input_transition in input_transitions:
-                if input_transition in visited_transitions:
-                    continue  # skip if the transition has already been visited
-
-                visited_transitions.add(input_transition)  # mark the transition as visited
-
-                if input_transition.label is not None:
-                    transition_list.append([input_transition])
-                    found_transition = True
-
-                if input_transition.label is None:
-                    transition_list.extend(find_previous_transitions(net, input_transition, visited_transitions, visited_places))
-
-        # if no transition was found, break the loop
-        if not found_transition:
-            break
-    
+        else:
+            for place in places:
+                if visited[place]:
+                    continue  # skip if the place has already been visited
+
+                self._visit(place)
+
+                for input_transition in preset[place]:
+                    if visited[input_transition]:
+                        continue  # skip if the transition has already been visited
+
+                    self._visit(input_transition)
+
+                    if not silent[input_transition]:
+                        transition_list.append([input_transition])
+                    else:
+                        transition_list.extend((yield input_transition))
+
+        self.active.discard(state)
+
+        return transition_list
+
+    def run(self, transition):
+        stack = [self._frame(self.graph["node_id"][transition])]
+        value = None
+
+        while True:
+            try:
+                child = stack[-1].send(value)
+            except StopIteration as stop:
+                stack.pop()
+                value = stop.value
+                if len(stack) == 0:
+                    break
+                continue
+
+            value = None
+            stack.append(self._frame(child))
+
+        nodes = self.graph["nodes"]
+        return [[nodes[t] for t in t_list] for t_list in value]
+
+    def visited_nodes(self):
+        """Returns the places and transitions visited by the search."""
+        nodes = self.graph["nodes"]
+        return [nodes[node] for node in self.visit_order]
+
+
+# per-net search graph and sweep over all transitions, keyed by PetriNetIndex
+_SEARCH_CACHE = weakref.WeakKeyDictionary()
+
+
+def _search_cache(index):
+    cache = _SEARCH_CACHE.get(index)
+    if cache is None:
+        arrays = index.arrays
+        n_places = arrays.n_places
+        pre_indptr = arrays.pre_indptr.tolist()
+        pre_indices = arrays.pre_indices.tolist()
+        source = [i for i, p in enumerate(index.places) if p.name == 'source']
+
+        graph = {
+            "nodes": index.places + index.transitions,
+            "node_id": {node: i for i, node in enumerate(index.places + index.transitions)},
+            "preset": [pre_indices[pre_indptr[i]:pre_indptr[i + 1]] for i in range(arrays.n_nodes)],
+            "silent": [False] * n_places + arrays.silent.tolist(),
+            "source": source[0] if len(source) > 0 else -1,
+        }
+        cache = _SEARCH_CACHE[index] = {"graph": graph, "all": None}
+    return cache
+
+
+def find_previous_transitions(net, current_transition, visited_transitions=None, visited_places=None):
+
+    """
+    Finds the previous possible non-silent transitions from some starting transition
+
+    Inputs:
+    net: a Petri net
+    current_transition: the transition to find all previous transitions from
+
+    Outputs:
+    transition_list: a list of previous possible transitions
+    """
+    if visited_transitions is None:
+        visited_transitions = set()
+    if visited_places is None:
+        visited_places = set()
+
+    index = get_net_index(net)
+    cache = _search_cache(index)
+    search = _PreviousTransitionSearch(cache["graph"], visited_transitions, visited_places)
+
+    transition_list = search.run(current_transition)
+
+    for node in search.visited_nodes():
+        if node in index.transition_id:
+            visited_transitions.add(node)
+        else:
+            visited_places.add(node)
+
     return transition_list
 
+
+def find_all_previous_transitions(net):
+
+    """
+    Finds the previous possible non-silent transitions of every non-silent transition
+
+    find_previous_transitions is run once for each non-silent transition, and the result is cached on the net index,
+    so later calls for the same net reuse it.
+
+    Inputs:
+    net: a Petri net
+
+    Outputs:
+    previous_transitions: a dictionary mapping each non-silent transition to its list of previous possible transitions,
+    as returned by find_previous_transitions
+    """
+
+    index = get_net_index(net)
+    cache = _search_cache(index)
+
+    if cache["all"] is None:
+        cache["all"] = {t: find_previous_transitions(net, t) for t in index.transitions if t.label is not None}
+
+    return cache["all"]
+
+
+def _group_by(keys, n_keys):
+    """
+    Returns the positions of an integer key array grouped by key (original order kept within a group),
+    and the offsets of each key's group.
+    """
+    order = np.argsort(keys, kind="stable")
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+    return order, offsets
+
+
 def generate_F(net, log):
 
     """
     Finds a dictionary of pdfs associated with each transitions in the net
 
+    The log is walked once to build a table of consecutive event pairs and their delays, and each transition's
+    delays are then looked up by grouped indexing into that table.
+
     Inputs:
     net: the Petri net
-    log: the event log the Petri net was discovered from
+    log: the event log the Petri net was discovered from, or its LogColumns
 
     Outputs:
     F: a dictionary containing pdfs for each key (transition in the Petri net)
     """
 
-    transitions = [t for t in net.transitions if t.label is not None]
+    columns = log if isinstance(log, LogColumns) else log_to_columns(log)
+    case_index, activity_codes, activity_names, timestamps = (columns.case_index, columns.activity_codes,
+                                                              columns.activity_names, columns.timestamps)
+    code_of = {name: code for code, name in enumerate(activity_names)}
+    n_activities = len(activity_names)
+
+    # consecutive event pairs within a trace, grouped by (current activity, previous activity)
+    same_trace = case_index[1:] == case_index[:-1]
+    pair_delays = (timestamps[1:] - timestamps[:-1])[same_trace]
+    pair_keys = (activity_codes[1:] * n_activities + activity_codes[:-1])[same_trace]
+    pair_order = np.argsort(pair_keys, kind="stable")
+    sorted_keys = pair_keys[pair_order]
+
+    # events grouped by activity, in log order within each activity
+    event_order, event_offsets = _group_by(activity_codes, n_activities)
+
+    def single_delays(code, previous_code):
+        key = code * n_activities + previous_code
+        start, end = np.searchsorted(sorted_keys, [key, key + 1])
+        return pair_delays[pair_order[start:end]]
+
+    def synchronised_delays(code, previous_codes):
+        # last occurrence of the activity in each trace that contains it
+        events = event_order[event_offsets[code]:event_offsets[code + 1]]
+        traces = case_index[events]
+        is_last = np.append(traces[1:] != traces[:-1], True)
+        b_traces = traces[is_last]
+        b_times = timestamps[events[is_last]]
+
+        # occurrences of any of the previous activities in those traces
+        candidates = np.sort(np.concatenate([event_order[event_offsets[c]:event_offsets[c + 1]] for c in previous_codes]))
+        candidate_traces = case_index[candidates]
+        position = np.minimum(np.searchsorted(b_traces, candidate_traces), len(b_traces) - 1)
+        delays = b_times[position] - timestamps[candidates]
+        keep = (b_traces[position] == candidate_traces) & (delays >= 0)
+        delays = delays[keep]
+        candidate_traces = candidate_traces[keep]
+
+        # minimum non-negative delay per trace, in log order
+        if len(delays) == 0:
+            return delays
+        starts = np.flatnonzero(np.append(True, candidate_traces[1:] != candidate_traces[:-1]))
+        return np.minimum.reduceat(delays, starts)
+
+    previous_transitions = find_all_previous_transitions(net)
+
+    F = {t.name: [] for t in net.transitions}
+
+    for t in net.transitions:
+        if t.label is None:
+            continue
+
+        code = code_of.get(t.label)
+        delay_time = []
 
-    previous_transitions_dict = {t: 0 for t in transitions}
+        for t_list in previous_transitions[t]:
+            if code is None:
+                continue
+            if len(t_list) == 1: # if only one possible transition, search log and add time delay
+                previous_code = code_of.get(t_list[0].label)
+                if previous_code is not None:
+                    delay_time.extend((single_delays(code, previous_code) / 1e6).tolist())
 
-    # generate a dictionary of previous possible transitions
-    for t in transitions:
-        previous_transitions_dict[t] = find_previous_transitions(net, t)
+            else: # if multiple possible transitions (synchronised events), search log and add the minimum time delay
+                previous_codes = {code_of[t_.label] for t_ in t_list if t_.label in code_of}
+                if len(previous_codes) > 0 and event_offsets[code + 1] > event_offsets[code]:
+                    delay_time.extend((synchronised_delays(code, previous_codes) / 1e6).tolist())
 
-    
-    # initialise time delay dict
-    delay_time_dict = {k: 0 for k in previous_transitions_dict.keys()}
+        F[t.name] = delay_time
 
-    for key in previous_transitions_dict.keys():
-        delay_time = []
-        for t_list in previous_transitions_dict[key]:
-            if len(t_list) == 1: # if only one possible transition, search log and add time delay
-                transition = t_list[0]
-                
-                for trace in log:
-                    for i in range(1, len(trace)):
-                        curr_event = trace[i]
-                        prev_event = trace[i-1]
+    return F
 
-                        if curr_event['concept:name'] == key.label and prev_event['concept:name'] == transition.label:
-                            delay_time.append((curr_event['time:timestamp'] - prev_event['time:timestamp']).total_seconds())
 
-            else: # if multiple possible transitions (synchronised events), search log and add the minimum time delay
+DelayArrays = namedtuple("DelayArrays", ["names", "indptr", "delays"])
+DelayArrays.__doc__ = """
+CSR form of the delays returned by generate_F.
+
+Attributes:
+names: list of the transition names, in the order of F
+indptr: int64 array of offsets, the delays of names[i] being delays[indptr[i]:indptr[i + 1]]
+delays: float64 array of all delays, in the order of F
+"""
+
+
+def delays_to_arrays(F):
+
+    """
+    This function flattens the dictionary of delays per transition into one array with per-transition offsets.
+
+    Inputs:
+    F: the dictionary of delays per transition returned by generate_F
+
+    Outputs:
+    arrays: the DelayArrays of F
+    """
+
+    names = list(F)
+    counts = np.array([len(F[name]) for name in names], dtype=np.int64)
+    indptr = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    delays = np.concatenate([np.asarray(F[name], dtype=np.float64) for name in names]) if names else np.zeros(0)
+
+    return DelayArrays(names, indptr, delays)
+
+
+def grouped_sum(values, indptr):
+    """
+    Returns the sum of each group of values, with 0 for empty groups.
+    """
+    sums = np.zeros(len(indptr) - 1)
+    nonempty = np.flatnonzero(np.diff(indptr) > 0)
+    if len(nonempty) > 0:
+        sums[nonempty] = np.add.reduceat(values, indptr[nonempty])
+    return sums
+
+
+# bump when the layout of the stored delay distributions changes
+DELAY_FILE_VERSION = 1
+
+# fixed histogram bins shared by all transitions: 0, then logarithmic from 1 second to about 116 days, then the rest
+DEFAULT_BIN_EDGES = np.concatenate(([0.0], np.logspace(0, 7, 29), [np.inf]))
+
+DelayDistributions = namedtuple("DelayDistributions", ["transition_names", "count", "mean", "exp_rate", "lognorm_mu",
+                                                       "lognorm_sigma", "bin_edges", "histogram"])
+DelayDistributions.__doc__ = """
+Fitted delay distributions of the transitions of a free-choice stochastic Petri net, the stochastic part of the SPN.
+
+Every array has one entry (or row) per transition, in the order of transition_names. Delays are in seconds, as in
+generate_F. Parameters of transitions without delays are NaN.
+
+Attributes:
+transition_names: array of the transition names
+count: int64 array with the number of observed delays
+mean: the mean delay
+exp_rate: the rate of the fitted exponential distribution, 1 / mean (inf if all delays are 0)
+lognorm_mu, lognorm_sigma: the mean and standard deviation of the log of the positive delays (fitted lognormal)
+bin_edges: the histogram bin edges shared by all transitions
+histogram: int64 array with one row of bin counts per transition (the last bin is closed)
+"""
+
+
+def fit_delay_distributions(F, bin_edges=DEFAULT_BIN_EDGES):
+
+    """
+    Fits an exponential, a lognormal and a fixed-bin histogram to the delays of every transition in one batch
+
+    The delays are flattened into DelayArrays and every fit is a grouped reduction over them, using the maximum
+    likelihood estimates of each distribution.
+
+    Inputs:
+    F: the dictionary of delays per transition returned by generate_F, or its DelayArrays
+    bin_edges: the increasing histogram bin edges shared by all transitions
+
+    Outputs:
+    distributions: the DelayDistributions of the transitions
+    """
+
+    arrays = F if isinstance(F, DelayArrays) else delays_to_arrays(F)
+    delays = arrays.delays
+    counts = np.diff(arrays.indptr)
+    groups = np.repeat(np.arange(len(counts)), counts)
+    bin_edges = np.asarray(bin_edges, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = grouped_sum(delays, arrays.indptr) / counts
+        exp_rate = 1 / mean
+
+        # lognormal fit on the positive delays of each transition
+        positive = delays > 0
+        positive_counts = np.bincount(groups[positive], minlength=len(counts))
+        log_delays = np.log(delays[positive])
+        log_indptr = np.concatenate(([0], np.cumsum(positive_counts)))
+        lognorm_mu = grouped_sum(log_delays, log_indptr) / positive_counts
+        deviations = (log_delays - lognorm_mu[groups[positive]]) ** 2
+        lognorm_sigma = np.sqrt(grouped_sum(deviations, log_indptr) / positive_counts)
+
+    n_bins = len(bin_edges) - 1
+    bins = np.clip(np.searchsorted(bin_edges, delays, side="right") - 1, 0, n_bins - 1)
+    histogram = np.bincount(groups * n_bins + bins, minlength=len(counts) * n_bins).reshape(len(counts), n_bins)
+
+    return DelayDistributions(np.array(arrays.names, dtype=str), counts, mean, exp_rate, lognorm_mu, lognorm_sigma,
+                              bin_edges, histogram)
+
+
+def frozen_delay_distribution(distributions, transition_name, kind="lognorm"):
+
+    """
+    Returns the fitted delay distribution of a transition as a frozen scipy.stats distribution, e.g. to sample delays
+    when simulating the SPN
+
+    Inputs:
+    distributions: the DelayDistributions of the net
+    transition_name: the name of the transition
+    kind: "expon", "lognorm" or "histogram"
+
+    Outputs:
+    distribution: the frozen distribution, or None if the transition has no delays to fit
+    """
+
+    from scipy import stats
+
+    i = int(np.flatnonzero(distributions.transition_names == transition_name)[0])
+    if distributions.count[i] == 0:
+        return None
+
+    if kind == "expon":
+        return stats.expon(scale=distributions.mean[i])
+    if kind == "lognorm":
+        if np.isnan(distributions.lognorm_mu[i]):
+            return None
+        return stats.lognorm(s=distributions.lognorm_sigma[i], scale=np.exp(distributions.lognorm_mu[i]))
+    if kind == "histogram":
+        # the open last bin is closed at the largest finite edge
+        edges = distributions.bin_edges.copy()
+        edges[-1] = edges[-2] * 2 if np.isinf(edges[-1]) else edges[-1]
+        return stats.rv_histogram((distributions.histogram[i], edges), density=False)
+
+    raise ValueError("unknown distribution: {}".format(kind))
+
+
+def get_delays_path(pnml_path):
+    """Returns the path of the delay distributions stored next to a Petri net."""
+    split_path = pnml_path.split(sep='.pnml')
+    return split_path[0] + ".delays.npz"
+
+
+def _sources_match(stored, prefix, file_path):
+    import os
+    from event_log_cache import file_fingerprint
+
+    stat = os.stat(file_path)
+    if int(stored[prefix + "_size"]) != stat.st_size:
+        return False
+    if int(stored[prefix + "_mtime_ns"]) == stat.st_mtime_ns:
+        return True
+    return str(stored[prefix + "_sha256"]) == file_fingerprint(file_path)["sha256"]
+
+
+def save_delay_distributions(distributions, pnml_path, log_path):
+
+    """
+    Stores the delay distributions of a net next to it, together with the fingerprints of the net and the log they
+    were fitted from
+
+    Inputs:
+    distributions: the DelayDistributions
+    pnml_path: path to the Petri net (.pnml)
+    log_path: path to the event log (.xes) the delays were taken from
+    """
+
+    import os
+    from event_log_cache import file_fingerprint
+
+    arrays = distributions._asdict()
+    arrays["version"] = np.int64(DELAY_FILE_VERSION)
+    for prefix, file_path in (("net", pnml_path), ("log", log_path)):
+        fingerprint = file_fingerprint(file_path)
+        arrays[prefix + "_mtime_ns"] = np.int64(fingerprint["mtime_ns"])
+        arrays[prefix + "_size"] = np.int64(fingerprint["size"])
+        arrays[prefix + "_sha256"] = np.array(fingerprint["sha256"])
+
+    # write to a temporary file first so that an interrupted run never leaves a truncated file behind
+    path = get_delays_path(pnml_path)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_delay_distributions(pnml_path, log_path, net=None, log=None, bin_edges=DEFAULT_BIN_EDGES):
+
+    """
+    Loads the delay distributions stored next to a Petri net, fitting and storing them first if there are none or
+    the net or log changed since
+
+    Inputs:
+    pnml_path: path to the Petri net (.pnml)
+    log_path: path to the event log (.xes) the net was discovered from
+    net: the Petri net, if already loaded
+    log: the LogColumns of the log, if already loaded
+    bin_edges: the histogram bin edges used when fitting
+
+    Outputs:
+    distributions: the DelayDistributions of the net
+    """
+
+    import os
+
+    path = get_delays_path(pnml_path)
+    if os.path.exists(path):
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                stored = {key: data[key] for key in data.files}
+        except (OSError, ValueError):
+            stored = None
+
+        if (stored is not None and int(stored.get("version", -1)) == DELAY_FILE_VERSION
+                and np.array_equal(stored["bin_edges"], bin_edges)
+                and _sources_match(stored, "net", pnml_path) and _sources_match(stored, "log", log_path)):
+            return DelayDistributions(**{field: stored[field] for field in DelayDistributions._fields})
+
+    if net is None:
+        from petri_net_cache import load_petri_net
+        net, _, _ = load_petri_net(pnml_path)
+    if log is None:
+        from event_log_cache import read_log_columns
+        log, _ = read_log_columns(log_path)
+
+    distributions = fit_delay_distributions(generate_F(net, log), bin_edges)
+    save_delay_distributions(distributions, pnml_path, log_path)
+    return distributions
 
-                t_list_names = [t.label for t in t_list]
-                for trace in log:
-                    trace_event_names = {event['concept:name'] for event in trace}
-                    timestamp_b = None
-                    timestamp_a = None
-
-                    if any(t_list_name in trace_event_names for t_list_name in t_list_names) and key.label in trace_event_names:
-                        for event in trace:
-                            if event['concept:name'] == key.label:
-                                timestamp_b = event['time:timestamp']
-                        delay_time_single = np.inf
-                        for event in trace:
-                            if event['concept:name'] in t_list_names:
-                                timestamp_a = event['time:timestamp']
-                                delta = (timestamp_b - timestamp_a).total_seconds()
-
-                                if delta < delay_time_single and delta >= 0:
-                                    delay_time_single = delta
-                        if delay_time_single != np.inf:
-                            delay_time.append(delay_time_single)
-        
-        delay_time_dict[key] = delay_time
 
-    name_keys = [t.name for t in net.transitions]
+if __name__ == "__main__":
+    from load_config import load_config
+    import os
+    import argparse
 
-    label_time_differences = {key: [] for key in name_keys}
+    config = load_config()
 
-    for key in delay_time_dict.keys():
-        label_time_differences[key.name] = delay_time_dict[key]
+    parser = argparse.ArgumentParser(description="Fit and store the delay distributions of the transitions of Petri nets.")
+    parser.add_argument("--pn", type=str, nargs="+", required=True, choices=["brazil_1.pnml", "brazil_2.pnml", "honduras_coordinated.pnml", "honduras_uncoordinated.pnml", "uae_coordinated.pnml", "uae_uncoordinated.pnml"], help="Petri net filenames (relative to project root)")
+    args = parser.parse_args()
 
-    
-    F = {key: 0 for key in name_keys}
+    for pn in args.pn:
+        pnml_path = os.path.join(config["project_root"], "data", pn)
+        distributions = load_delay_distributions(pnml_path, pnml_path.split(sep=".pnml")[0] + ".xes")
 
-    for label in label_time_differences.keys():
-        times = label_time_differences[label]
-        F[label] = times
-    
-    return F
\ No newline at end of file
+        fitted = distributions.count > 0
+        print("{}: delays of {} of {} transitions stored in {}".format(pn, int(fitted.sum()), len(fitted), get_delays_path(pnml_path)))
@@ -1,150 +1,426 @@
-def create_brazil_event_logs(project_root, trim_length, log_length):
+from collections import namedtuple
+
+# only these columns are read from the election CSVs; botscore stays float64 so that the cohort thresholds
+# compare exactly. Retweet IDs are read as exact integers: inferred as float64 (the column has gaps), 2018 tweet IDs
+# (around 1.05e18) were rounded to multiples of 128, which changed case IDs and merged some retweeted tweets
+BRAZIL_COLUMNS = {
+    'retweeted_status.id_str': 'Int64',
+    'user.id_str': 'str',
+    'timestamp_ms': 'Int64',
+    'botscore': 'float64',
+}
+
+Cohort = namedtuple("Cohort", ["name", "lower", "upper", "include_upper"])
+Cohort.__doc__ = """
+A band of bot scores whose users make up one event log.
+
+Attributes:
+name: the name of the cohort, used as the file name of its log
+lower: the inclusive lower bound of the bot score (None for no bound)
+upper: the upper bound of the bot score (None for no bound)
+include_upper: True if the upper bound is inclusive
+"""
+
+# coordinated if botscore is >= 0.9 and uncoordinated if <= 0.1
+BRAZIL_COHORTS = (
+    Cohort("brazil_1", 0.9, None, True),
+    Cohort("brazil_2", None, 0.1, True),
+)
+
+
+def cohorts_from_bins(edges, names):
 
     """
-    This function converts a jsonlines file to an EventLog for the Brazil datasets. 
+    This function creates one cohort per bin of bot scores.
+
+    Bins are [edges[i], edges[i + 1]), except for the last bin which also includes its upper edge.
 
     Inputs:
-    folder_path: path to folder containing brazil_elections-2018 dataset
-    trim_length: length to trim each trace to
-    log_length: desired length of returned log
+    edges: increasing bin edges
+    names: the name of each bin (one fewer than edges)
 
     Outputs:
-    brazil_1_short_log: an event log for the users with a bot score of >= 0.9
-    brazil_2_short_log: an event log for the users with a bot score of <= 0.1
+    cohorts: a list of Cohorts
     """
-    import pm4py
-    from pm4py.objects.conversion.log import converter as log_converter
-    from pm4py.filtering import filter_case_size
-    from pm4py.objects.log.obj import EventLog, Trace
-    import os
-    import pandas as pd
+    if len(names) != len(edges) - 1:
+        raise ValueError("expected {} cohort names for {} bin edges, got {}".format(len(edges) - 1, len(edges), len(names)))
+    if any(lower >= upper for lower, upper in zip(edges[:-1], edges[1:])):
+        raise ValueError("bin edges must be strictly increasing")
 
-    print("collecting files...")
+    return [Cohort(name, edges[i], edges[i + 1], i == len(names) - 1) for i, name in enumerate(names)]
 
-    folder_path = os.path.join(project_root, "data/brazil_elections-2018")
 
-    dataframes = []
+def cohorts_from_config(config):
 
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".csv"):
-            file_path = os.path.join(folder_path, filename)
-            df = pd.read_csv(file_path)
+    """
+    This function reads the cohort definitions from the "brazil_cohorts" entry of the configuration.
 
-            dataframes.append(df)
+    The entry is either a list of {"name", "min", "max", "include_max"} objects (min is inclusive, max is inclusive
+    unless include_max is false, and either bound can be left out) or a {"edges", "names"} object of bins.
 
-    data = pd.concat(dataframes, ignore_index=True)
+    Inputs:
+    config: the configuration dictionary
 
-    df = data.loc[:, ['retweeted_status.id_str', 'user.id_str', 'timestamp_ms', 'botscore']]
+    Outputs:
+    cohorts: a list of Cohorts, BRAZIL_COHORTS if the configuration does not define any
+    """
+    spec = config.get("brazil_cohorts")
+    if spec is None:
+        cohorts = list(BRAZIL_COHORTS)
+    elif isinstance(spec, dict):
+        cohorts = cohorts_from_bins(spec["edges"], spec["names"])
+    else:
+        cohorts = [Cohort(c["name"], c.get("min"), c.get("max"), c.get("include_max", True)) for c in spec]
 
-    df = df.rename(columns = {'retweeted_status.id_str': 'retweet_tweetid', 'user.id_str': 'userid', 'timestamp_ms': 'tweet_time'})
+    validate_cohorts(cohorts)
+    return cohorts
 
-    # convert times to datetime format
-    df['tweet_time'] = pd.to_datetime(df['tweet_time'], unit='ms')
-    # remove problematic ID characters
-    df['userid'] = df['userid'].astype('str')
-    df['userid'] = df['userid'].str.replace('[+=]', '', regex=True)
-    df['userid'] = ['u' + id for id in df['userid']]
-    # convert tweet ID to int
-    df['retweet_tweetid'] = df['retweet_tweetid'].astype('Int64')
+
+def _cohorts_overlap(a, b):
+    lower = max(-float("inf") if a.lower is None else a.lower, -float("inf") if b.lower is None else b.lower)
+    upper_a = float("inf") if a.upper is None else a.upper
+    upper_b = float("inf") if b.upper is None else b.upper
+
+    # the intersection is [lower, upper], closed at upper only if the bound it comes from is inclusive
+    if upper_a < upper_b:
+        upper, include_upper = upper_a, a.include_upper
+    elif upper_b < upper_a:
+        upper, include_upper = upper_b, b.include_upper
+    else:
+        upper, include_upper = upper_a, a.include_upper and b.include_upper
+
+    return lower < upper or (lower == upper and include_upper)
+
+
+def validate_cohorts(cohorts):
+
+    """
+    This function checks that cohorts have distinct names and non-empty, non-overlapping bot score bands,
+    so that every user belongs to at most one cohort.
+
+    Inputs:
+    cohorts: a list of Cohorts
+    """
+    names = [cohort.name for cohort in cohorts]
+    if len(set(names)) != len(names):
+        raise ValueError("cohort names must be unique: {}".format(names))
+
+    for cohort in cohorts:
+        if cohort.lower is not None and cohort.upper is not None:
+            if cohort.lower > cohort.upper or (cohort.lower == cohort.upper and not cohort.include_upper):
+                raise ValueError("cohort {} has an empty bot score band".format(cohort.name))
+
+    for i, a in enumerate(cohorts):
+        for b in cohorts[i + 1:]:
+            if _cohorts_overlap(a, b):
+                raise ValueError("cohorts {} and {} overlap".format(a.name, b.name))
+
+
+def assign_cohorts(botscore, cohorts):
+
+    """
+    This function finds the cohort of every row from its bot score.
+
+    Inputs:
+    botscore: a Series of bot scores
+    cohorts: a list of non-overlapping Cohorts
+
+    Outputs:
+    codes: an int16 array with the index of each row's cohort in cohorts, or -1 if it belongs to none
+    """
+    import numpy as np
+
+    values = botscore.to_numpy(dtype=np.float64, na_value=np.nan)
+    codes = np.full(len(values), -1, dtype=np.int16)
+
+    for i, cohort in enumerate(cohorts):
+        mask = ~np.isnan(values)
+        if cohort.lower is not None:
+            mask &= values >= cohort.lower
+        if cohort.upper is not None:
+            mask &= (values <= cohort.upper) if cohort.include_upper else (values < cohort.upper)
+        codes[mask] = i
+
+    return codes
+
+
+def read_brazil_file(file_path, cohorts=BRAZIL_COHORTS, start=0, end=None):
+
+    """
+    This function reads one CSV of the Brazil dataset and assigns each retweet to a bot score cohort.
+
+    Only the four columns in BRAZIL_COLUMNS are parsed, so the tweet text and other fields are never held in memory.
+
+    Inputs:
+    file_path: path to a CSV file of the brazil_elections-2018 dataset
+    cohorts: a list of non-overlapping Cohorts
+    start: byte offset of the first row to read, used to read only the rows appended to a file
+    end: byte offset after the last row to read (default: the end of the file)
+    Both offsets must fall between rows, not inside a quoted field (see _complete_rows_end).
+
+    Outputs:
+    df: the retweets in the file that belong to a cohort, with retweet_tweetid, userid, tweet_time and cohort
+    (the index of the cohort in cohorts) columns
+    """
+    from event_log_pipeline import normalise_userids
+    import io
+    import pandas as pd
+
+    source = file_path
+    if start > 0 or end is not None:
+        # parse the byte range as a CSV of its own, under the header of the file
+        with open(file_path, "rb") as f:
+            header = f.readline()
+            f.seek(max(start, len(header)))
+            data = f.read() if end is None else f.read(max(end - f.tell(), 0))
+        source = io.BytesIO(header + data)
+
+    df = pd.read_csv(source, usecols=list(BRAZIL_COLUMNS), dtype=BRAZIL_COLUMNS)
+
+    df = df.rename(columns = {'retweeted_status.id_str': 'retweet_tweetid', 'user.id_str': 'userid', 'timestamp_ms': 'tweet_time'})
 
     # format dataframe
-    df.sort_values(by = 'tweet_time', ascending=True, inplace=True)
     df = df[df['retweet_tweetid'].isnull() == False]
     df = df[df['userid'].isnull() == False]
 
-    # split dataset using botscore - coordinated if botscore is >= 0.9 and uncoordinated if <= 0.1
-    brazil_1_df = df[df['botscore'] >= 0.9]
-    brazil_2_df = df[df['botscore'] <= 0.1]
+    # split dataset using botscore
+    df = df.assign(cohort=assign_cohorts(df['botscore'], cohorts))
+    df = df.loc[df['cohort'] >= 0, ['retweet_tweetid', 'userid', 'tweet_time', 'cohort']]
 
+    # convert times to datetime format
+    df['tweet_time'] = pd.to_datetime(df['tweet_time'], unit='ms')
+    # remove problematic ID characters, storing user IDs as a categorical
+    df['userid'] = normalise_userids(df['userid'])
 
-    brazil_1_df = brazil_1_df.loc[:, ['retweet_tweetid', 'userid', 'tweet_time']]
-    brazil_2_df = brazil_2_df.loc[:, ['retweet_tweetid', 'userid', 'tweet_time']]
+    return df
 
-    cols = ['case:concept:name', 'concept:name', 'time:timestamp']
-    brazil_1_df.columns = cols
-    brazil_2_df.columns = cols
 
-    selected_df = brazil_2_df
+def create_brazil_event_logs(project_root, trim_length, log_length, workers=None, cohorts=BRAZIL_COHORTS):
 
-    idx = selected_df.groupby(['case:concept:name', 'concept:name'])['time:timestamp'].idxmin()
-    earliest_events_df = selected_df.loc[idx].reset_index(drop=True)
-    earliest_events_df.sort_values(by = 'time:timestamp', ascending=True, inplace=True)
+    """
+    This function converts the csv files of the Brazil dataset to one EventLog per bot score cohort.
 
-    length_df = earliest_events_df.groupby('case:concept:name').filter(lambda x: len(x) >= 2)
+    Files are parsed concurrently on a process pool and each row is assigned to its cohort as it is read. The earliest
+    retweet of each user, trimming and truncation are then computed for all cohorts in one grouped pass, and one
+    .xes file per cohort is written to the data folder.
 
+    Inputs:
+    project_root: path to the project root, containing data/brazil_elections-2018
+    trim_length: length to trim each trace to
+    log_length: desired length of returned log
+    workers: the number of processes used to read the files (default: the number of CPUs)
+    cohorts: a list of non-overlapping Cohorts (default: brazil_1 for a bot score of >= 0.9 and brazil_2 for <= 0.1)
 
-    brazil_2_log = log_converter.apply(length_df, variant=log_converter.Variants.TO_EVENT_LOG)
+    Outputs:
+    logs: a dictionary mapping each cohort name to its event log
+    """
+    from event_log_pipeline import earliest_events, trim_and_truncate
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    import os
+    import pandas as pd
+    from pandas.api.types import union_categoricals
 
-    # trim each trace of log to length n
+    cohorts = list(cohorts)
+    validate_cohorts(cohorts)
 
-    brazil_2_trimmed_log = EventLog()
+    print("collecting files...")
 
-    for trace in brazil_2_log:
-        if len(trace) > trim_length:
-            trimmed_trace = Trace()
-            for i in range(trim_length):
-                trimmed_trace.append(trace[i])
-            brazil_2_trimmed_log.append(trimmed_trace)
-        else:
-            brazil_2_trimmed_log.append(trace)
+    folder_path = os.path.join(project_root, "data/brazil_elections-2018")
 
-    # remove traces of length 1
-    brazil_2_filtered_log = filter_case_size(brazil_2_trimmed_log, 2, 1e6)
+    file_paths = [os.path.join(folder_path, filename) for filename in os.listdir(folder_path) if filename.endswith(".csv")]
 
-    # select the first x traces
-    brazil_2_short_log = EventLog()
+    if workers is None:
+        workers = os.cpu_count()
 
-    for i in range(log_length):
-        brazil_2_short_log.append(brazil_2_filtered_log[i])
+    # partitions are returned in file order, so the merged frame matches reading the files one after another
+    read_file = partial(read_brazil_file, cohorts=cohorts)
+    if workers <= 1 or len(file_paths) <= 1:
+        partitions = [read_file(file_path) for file_path in file_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+            partitions = list(executor.map(read_file, file_paths))
 
+    # merge the categories of every file so that user IDs stay categorical in the merged frame
+    userids = union_categoricals([partition['userid'] for partition in partitions])
+    df = pd.concat([partition.drop(columns='userid') for partition in partitions], ignore_index=True)
+    df.insert(1, 'userid', userids)
+    df.columns = ['case:concept:name', 'concept:name', 'time:timestamp', 'cohort']
 
-    
-    selected_df = brazil_1_df
+    # keep the earliest retweet of each user, trim each trace, remove traces of length 1 and select the first x
+    # traces of every cohort at once, converting only the selected events to logs
+    short_df = trim_and_truncate(earliest_events(df, by=['cohort']), trim_length, log_length, by=['cohort'])
 
-    idx = selected_df.groupby(['case:concept:name', 'concept:name'])['time:timestamp'].idxmin()
-    earliest_events_df = selected_df.loc[idx].reset_index(drop=True)
-    earliest_events_df.sort_values(by = 'time:timestamp', ascending=True, inplace=True)
+    return write_cohort_logs(short_df, cohorts, project_root)
 
-    length_df = earliest_events_df.groupby('case:concept:name').filter(lambda x: len(x) >= 2)
 
+def write_cohort_logs(short_df, cohorts, project_root):
 
-    brazil_1_log = log_converter.apply(length_df, variant=log_converter.Variants.TO_EVENT_LOG)
+    """
+    This function converts the selected events of every cohort to an EventLog and writes it to data/<cohort name>.xes.
 
-    # trim each trace of log to length n
+    Inputs:
+    short_df: the selected events, with case:concept:name, concept:name, time:timestamp and cohort columns
+    cohorts: the list of Cohorts the cohort column refers to
+    project_root: path to the project root
 
-    brazil_1_trimmed_log = EventLog()
+    Outputs:
+    logs: a dictionary mapping each cohort name to its event log
+    """
+    import pm4py
+    from pm4py.objects.log.obj import EventLog
+    from event_log_pipeline import dataframe_to_event_log
+    import os
 
-    for trace in brazil_1_log:
-        if len(trace) > trim_length:
-            trimmed_trace = Trace()
-            trimmed_trace.attributes.update(trace.attributes)
-            for i in range(trim_length):
-                trimmed_trace.append(trace[i])
-            brazil_1_trimmed_log.append(trimmed_trace)
+    short_df = short_df.loc[:, ['case:concept:name', 'concept:name', 'time:timestamp', 'cohort']]
+    groups = dict(list(short_df.groupby('cohort', sort=False)))
+
+    logs = {}
+    for i, cohort in enumerate(cohorts):
+        if i in groups:
+            logs[cohort.name] = dataframe_to_event_log(groups[i].drop(columns='cohort'))
         else:
-            brazil_1_trimmed_log.append(trace)
+            logs[cohort.name] = EventLog()
+
+        pm4py.write_xes(logs[cohort.name], os.path.join(project_root, "data", cohort.name + ".xes"))
+
+    return logs
+
+
+def _complete_rows_end(file_path, start=0, block_size=1 << 20):
+    """
+    Returns the byte offset just after the last complete row of a CSV file, so that a row still being written is not
+    read.
 
-    # remove traces of length 1
-    brazil_1_filtered_log = filter_case_size(brazil_1_trimmed_log, 2, 1e6)
+    Quoted fields of the tweet CSVs can contain newlines, so a newline only ends a row when it is outside quotes. The
+    file is scanned from start, which must be a row boundary (such as an offset returned before), tracking the parity
+    of the quotes read so far; escaped quotes ("") leave the parity unchanged.
 
-    # select the first x traces
-    brazil_1_short_log = EventLog()
+    Inputs:
+    file_path: path to a CSV file
+    start: a byte offset at the start of a row
+    block_size: the number of bytes scanned at a time
+
+    Outputs:
+    end: the offset after the last newline outside quotes, or start if there is none
+    """
+    import numpy as np
+
+    end = start
+    in_quotes = 0
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        position = start
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            data = np.frombuffer(block, dtype=np.uint8)
+            # quote parity after each byte, which for a newline is the parity before it
+            parity = (in_quotes + np.cumsum(data == ord('"'))) & 1
+            row_ends = np.flatnonzero((data == ord('\n')) & (parity == 0))
+            if len(row_ends) > 0:
+                end = position + int(row_ends[-1]) + 1
+            in_quotes = int(parity[-1])
+            position += len(block)
+    return end
+
+
+def create_brazil_event_logs_incremental(project_root, checkpoint_path, trim_length, log_length, workers=None,
+                                         cohorts=BRAZIL_COHORTS, max_segments=None):
+
+    """
+    This function updates the event logs of the Brazil dataset, reading only the CSV files and rows added since the
+    last run.
+
+    For every cohort and retweeted tweet, the earliest retweets of its trim_length earliest users are kept in an
+    append-only checkpoint (see event_log_checkpoint.py) together with the byte offset up to which each file has been
+    read. Each run reads the new rows of every file on a process pool, updates the cases they touch and writes one
+    .xes file per cohort from the checkpoint. Retweets with equal timestamps are ordered by the order in which they
+    were read. If a file was shortened or removed, or trim_length or the cohorts changed, the checkpoint is rebuilt;
+    rows already read are assumed not to change (see EventLogCheckpoint.check_sources).
 
-    for i in range(log_length):
-        brazil_1_short_log.append(brazil_1_filtered_log[i])
+    Inputs:
+    project_root: path to the project root, containing data/brazil_elections-2018
+    checkpoint_path: the folder of the checkpoint
+    trim_length: length to trim each trace to
+    log_length: desired length of returned log
+    workers: the number of processes used to read the files (default: the number of CPUs)
+    cohorts: a list of non-overlapping Cohorts
+    max_segments: the checkpoint is compacted into one segment once it has more than this many (default:
+    event_log_checkpoint.MAX_SEGMENTS)
+
+    Outputs:
+    logs: a dictionary mapping each cohort name to its event log
+    """
+    from event_log_checkpoint import EventLogCheckpoint
+    from event_log_pipeline import update_case_state, trim_and_truncate
+    from concurrent.futures import ProcessPoolExecutor
+    import os
+    import numpy as np
 
+    cohorts = list(cohorts)
+    validate_cohorts(cohorts)
 
-    pm4py.write_xes(brazil_2_short_log, os.path.join(project_root, "data/brazil_2.xes"))
-    pm4py.write_xes(brazil_1_short_log, os.path.join(project_root, "data/brazil_1.xes"))
+    checkpoint = EventLogCheckpoint(checkpoint_path, {"trim_length": trim_length, "cohorts": [list(cohort) for cohort in cohorts]},
+                                    by=['cohort'])
+    checkpoint.check_sources()
+
+    folder_path = os.path.abspath(os.path.join(project_root, "data/brazil_elections-2018"))
+
+    # (file, start, end) of the rows not read yet
+    ranges = []
+    for filename in sorted(os.listdir(folder_path)):
+        if filename.endswith(".csv"):
+            file_path = os.path.join(folder_path, filename)
+            start = checkpoint.sources.get(file_path, 0)
+            end = _complete_rows_end(file_path, start)
+            if end > start:
+                ranges.append((file_path, start, end))
+
+    print("reading {} new or updated files...".format(len(ranges)))
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    def update(partitions):
+        for (file_path, start, end), df in zip(ranges, partitions):
+            df.columns = ['case:concept:name', 'concept:name', 'time:timestamp', 'cohort']
+            df['seq'] = checkpoint.next_seq + np.arange(len(df), dtype=np.int64)
+            updated = update_case_state(checkpoint.state, df, trim_length, dedup=True, by=['cohort'])
+            checkpoint.append(updated, {file_path: end}, checkpoint.next_seq + len(df))
+
+    arguments = ([file_path for file_path, _, _ in ranges], [cohorts] * len(ranges),
+                 [start for _, start, _ in ranges], [end for _, _, end in ranges])
+    if workers <= 1 or len(ranges) <= 1:
+        update(map(read_brazil_file, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+            # files are read ahead on the pool while the checkpoint is updated with each one in order
+            update(executor.map(read_brazil_file, *arguments))
+
+    checkpoint.compact_if_needed(max_segments)
+
+    short_df = trim_and_truncate(checkpoint.state, trim_length, log_length, by=['cohort'])
+
+    return write_cohort_logs(short_df, cohorts, project_root)
 
 if __name__ == "__main__":
     from load_config import load_config
+    import argparse
+    import os
 
     config = load_config()
 
     project_root = config['project_root']
 
-    create_brazil_event_logs(project_root, 10, 200)
-
+    parser = argparse.ArgumentParser(description="Generate one event log per bot score cohort from the Brazil election CSV files.")
+    parser.add_argument("--incremental", action="store_true", help="Only read the files and rows added since the last run, keeping a checkpoint in data/brazil.checkpoint")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes used to read the CSV files (default: number of CPUs)")
+    args = parser.parse_args()
 
-    
+    if args.incremental:
+        create_brazil_event_logs_incremental(project_root, os.path.join(project_root, "data/brazil.checkpoint"), 10, 200,
+                                             workers=args.workers, cohorts=cohorts_from_config(config))
+    else:
+        create_brazil_event_logs(project_root, 10, 200, workers=args.workers, cohorts=cohorts_from_config(config))
@@ -1,69 +1,244 @@
-def create_event_log(file_path, trim_length, log_length):
+import heapq
+import json
+import re
+from datetime import datetime, timezone
+
+# characters removed from user IDs before they are used as activity names
+_USERID_PATTERN = re.compile('[+=]')
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _parse_tweet_time(value):
     """
-    This function converts a jsonlines file to an EventLog for the Honduras and UAE datasets. This function saves the outputted event log
-    to the same folder containing the input data.
+    Converts a tweet_time value to nanoseconds since the epoch. Numbers are read as milliseconds, strings as dates.
+    """
+    if isinstance(value, (int, float)):
+        return int(value * 1_000_000)
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        import pandas as pd
+        timestamp = pd.Timestamp(value)
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert(None)
+        return timestamp.value
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def _parse_retweet_line(line):
+    """
+    Parses one jsonlines record into a (time in nanoseconds, activity, case) tuple, or None if it is not a retweet.
+    A missing user ID becomes the activity 'unan', as in event_log_pipeline.normalise_userids.
+    """
+    if not line.strip():
+        return None
+    record = json.loads(line)
+    retweet_tweetid = record.get('retweet_tweetid')
+    if retweet_tweetid is None or retweet_tweetid != retweet_tweetid:
+        return None
+    userid = record.get('userid')
+    userid = 'u' + _USERID_PATTERN.sub('', 'nan' if userid is None else str(userid))
+    return _parse_tweet_time(record['tweet_time']), userid, int(retweet_tweetid)
+
+
+def stream_retweet_events(file_path):
+    """
+    This function streams the retweet events of a jsonlines file, keeping only the tweet_time, userid and retweet_tweetid
+    fields of each line. Lines that are not retweets are skipped.
 
     Inputs:
-    file_path: the path to a corresponding jsonlines file containing the data from the Honduras or UAE datasets (coordinated or uncoordinated)
+    file_path: the path to a jsonlines file from the Honduras or UAE datasets
+
+    Outputs:
+    a generator of (time in nanoseconds, activity, case) tuples, in file order. The activity is the normalised user ID
+    and the case is the retweeted tweet ID.
+    """
+    # one string object per user, shared by all of its events
+    activities = {}
+
+    with open(file_path, "r") as f:
+        for line in f:
+            event = _parse_retweet_line(line)
+            if event is not None:
+                time, userid, case = event
+                yield time, activities.setdefault(userid, userid), case
+
+
+def create_event_log_streaming(file_path, trim_length, log_length):
+    """
+    This function builds the same event log as create_event_log while streaming the jsonlines file, so that peak memory
+    depends on the number of retweeted tweets and trim_length rather than on the size of the dataset. Both keep retweet
+    IDs as exact integers (see create_event_log).
+
+    For each case only the trim_length earliest events are kept, in a bounded heap. Cases are then ordered by their
+    earliest event, cases with fewer than 2 events are removed and the first log_length cases are converted to an
+    EventLog.
+
+    Inputs:
+    file_path: the path to a jsonlines file from the Honduras or UAE datasets
     trim_length: length to trim each trace to
     log_length: desired length of returned log
 
+    Outputs:
+    short_log: the event log
+    """
+    from event_log_pipeline import dataframe_to_event_log
+    import pandas as pd
+
+    print("streaming data...")
+
+    # per case: heap of the trim_length earliest events, stored as (-time, -line, activity) so the root is the latest
+    buffers = {}
+    # per case: key of its earliest event, used to order the cases
+    first_seen = {}
+    for line_number, (time, activity, case) in enumerate(stream_retweet_events(file_path)):
+        buffer = buffers.get(case)
+        if buffer is None:
+            buffer = buffers[case] = []
+            first_seen[case] = (time, line_number)
+        elif (time, line_number) < first_seen[case]:
+            first_seen[case] = (time, line_number)
+
+        item = (-time, -line_number, activity)
+        if len(buffer) < trim_length:
+            heapq.heappush(buffer, item)
+        elif item > buffer[0]:
+            heapq.heapreplace(buffer, item)
+
+    # order cases by their earliest event and keep the first log_length with at least 2 events
+    cases = [case for case in sorted(first_seen, key=first_seen.get) if len(buffers[case]) >= 2][:log_length]
+
+    rows = []
+    for case in cases:
+        for negative_time, negative_line, activity in buffers[case]:
+            rows.append((-negative_time, -negative_line, activity, case))
+    rows.sort()
+
+    df = pd.DataFrame({
+        'time:timestamp': pd.to_datetime([row[0] for row in rows], unit='ns'),
+        'concept:name': pd.Categorical([row[2] for row in rows]),
+        'case:concept:name': pd.array([row[3] for row in rows], dtype='Int64'),
+    })
+
+    short_log = dataframe_to_event_log(df)
+
+    return short_log
+
+
+def create_event_log_incremental(file_path, checkpoint_path, trim_length, log_length, chunk_size=1_000_000,
+                                 max_segments=None):
+    """
+    This function builds the event log of a jsonlines file that grows over time, reading only the lines added since the
+    last run.
+
+    The first trim_length events of every case are kept in an append-only checkpoint (see event_log_checkpoint.py)
+    together with the byte offset up to which the file has been read. Each run reads the new complete lines in chunks,
+    updates the cases they touch, and selects the log from the checkpoint. Events with equal timestamps are ordered
+    by their position in the file, as in create_event_log_streaming. If the file was shortened or removed, or
+    trim_length changed, the checkpoint is rebuilt from the start of the file. Lines already read are assumed not to
+    change: a file edited in place without getting shorter is not detected, and its checkpoint has to be deleted.
+
+    Inputs:
+    file_path: the path to a jsonlines file from the Honduras or UAE datasets
+    checkpoint_path: the folder of the checkpoint
+    trim_length: length to trim each trace to
+    log_length: desired length of returned log
+    chunk_size: the number of retweets read between checkpoint updates
+    max_segments: the checkpoint is compacted into one segment once it has more than this many (default:
+    event_log_checkpoint.MAX_SEGMENTS)
 
+    Outputs:
+    short_log: the event log
     """
-    from pm4py.objects.conversion.log import converter as log_converter
-    from pm4py.filtering import filter_case_size
-    from pm4py.objects.log.obj import EventLog, Trace
+    from event_log_checkpoint import EventLogCheckpoint
+    from event_log_pipeline import update_case_state, trim_and_truncate, dataframe_to_event_log
+    import os
     import pandas as pd
 
-    print("reading in data...")
-    data = pd.read_json(file_path, lines = True)
-
-    df = []
-    # select relevant columns in data
-    df = data.loc[:, ['tweet_time', 'userid', 'retweet_tweetid']]
-
-    # convert times to datetime format
-    df['tweet_time'] = pd.to_datetime(df['tweet_time'], unit='ms')
-    # remove problematic ID characters
-    df['userid'] = df['userid'].astype('str')
-    df['userid'] = df['userid'].str.replace('[+=]', '', regex=True)
-    df['userid'] = ['u' + id for id in df['userid']]
-    # convert tweet ID to int
-    df['retweet_tweetid'] = df['retweet_tweetid'].astype('Int64')
-
-    # format dataframe
-    df.sort_values(by = 'tweet_time', ascending=True, inplace=True)
-    df = df[df['retweet_tweetid'].isnull() == False]
-    df = df[df['userid'].isnull() == False]
+    source = os.path.abspath(file_path)
+    checkpoint = EventLogCheckpoint(checkpoint_path, {"trim_length": trim_length})
+    checkpoint.check_sources()
 
-    cols = ['time:timestamp', 'concept:name', 'case:concept:name']
-    df.columns = cols
+    def update(events, offset):
+        df = pd.DataFrame({
+            'case:concept:name': pd.array([event[2] for event in events], dtype='Int64'),
+            'concept:name': pd.Categorical([event[1] for event in events]),
+            'time:timestamp': pd.to_datetime([event[0] for event in events], unit='ns'),
+            'seq': checkpoint.next_seq + pd.RangeIndex(len(events)),
+        })
+        updated = update_case_state(checkpoint.state, df, trim_length)
+        checkpoint.append(updated, {source: offset}, checkpoint.next_seq + len(events))
+
+    offset = checkpoint.sources.get(source, 0)
+    print("reading new data from byte {}...".format(offset))
+
+    events = []
+    with open(source, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            # an incomplete last line is still being written and is read on the next run
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            event = _parse_retweet_line(line)
+            if event is not None:
+                events.append(event)
+                if len(events) == chunk_size:
+                    update(events, offset)
+                    events = []
+
+    if events or offset != checkpoint.sources.get(source, 0):
+        update(events, offset)
+
+    checkpoint.compact_if_needed(max_segments)
 
+    # the state is sorted by time and file position, so trimming keeps the same events
+    short_df = trim_and_truncate(checkpoint.state, trim_length, log_length)
+    short_log = dataframe_to_event_log(short_df.loc[:, ['time:timestamp', 'concept:name', 'case:concept:name']])
 
-    # convert df to log
-    log = log_converter.apply(df, variant=log_converter.Variants.TO_EVENT_LOG)
+    return short_log
 
 
-    trimmed_log = EventLog()
+def create_event_log(file_path, trim_length, log_length):
+    """
+    This function converts a jsonlines file to an EventLog for the Honduras and UAE datasets. This function saves the outputted event log
+    to the same folder containing the input data.
 
-    for trace in log:
-        if len(trace) > trim_length:
-            trimmed_trace = Trace()
-            trimmed_trace.attributes.update(trace.attributes)
-            for i in range(trim_length):
-                trimmed_trace.append(trace[i])
-            trimmed_log.append(trimmed_trace)
-        else:
-            trimmed_log.append(trace)
+    Inputs:
+    file_path: the path to a corresponding jsonlines file containing the data from the Honduras or UAE datasets (coordinated or uncoordinated)
+    trim_length: length to trim each trace to
+    log_length: desired length of returned log
 
-    # remove traces of length 1
-    filtered_log = filter_case_size(trimmed_log, 2, 1e6)
+    Retweet IDs are kept as exact integers. Earlier versions read the file with pd.read_json, which parsed
+    retweet_tweetid as float64 and rounded every ID to a multiple of 128, so retweeted tweets whose IDs rounded to the
+    same value were merged into one case. Logs generated now can therefore split such traces, and through the trace
+    length filter and the log_length cut select different traces than those earlier logs.
+    """
+    from event_log_pipeline import trim_and_truncate, dataframe_to_event_log
+    import pandas as pd
+
+    print("reading in data...")
+    # the retweets are parsed line by line rather than with pd.read_json, which reads retweet_tweetid (a column with
+    # gaps) as float64 and rounds tweet IDs (around 1e18) to multiples of 128
+    events = list(stream_retweet_events(file_path))
+
+    df = pd.DataFrame({
+        'tweet_time': pd.to_datetime([event[0] for event in events], unit='ns'),
+        # user IDs without problematic characters, stored as a categorical
+        'userid': pd.Categorical([event[1] for event in events]),
+        'retweet_tweetid': pd.array([event[2] for event in events], dtype='Int64'),
+    })
+
+    cols = ['time:timestamp', 'concept:name', 'case:concept:name']
+    df.columns = cols
 
-    # select the first x traces
-    short_log = EventLog()
+    # sort, trim each trace, remove traces of length 1 and select the first x traces before converting to a log
+    short_df = trim_and_truncate(df, trim_length, log_length)
 
-    for i in range(log_length):
-        short_log.append(filtered_log[i])
+    short_log = dataframe_to_event_log(short_df)
 
     return short_log
 
@@ -78,6 +253,8 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Run script on a dataset.")
     parser.add_argument("--dataset", type=str, required=True, choices=["uae-good-anonymized", "uae-bad-anonymized", "honduras-good-anonymized", "honduras-bad-anonymized"], help="Dataset filename (relative to project root)")
+    parser.add_argument("--in-memory", action="store_true", help="Read all retweets of the dataset into one DataFrame instead of streaming it")
+    parser.add_argument("--incremental", action="store_true", help="Only read the lines added since the last run, keeping a checkpoint next to the output log")
     args = parser.parse_args()
 
     # Construct dataset path
@@ -99,6 +276,12 @@ if __name__ == "__main__":
         output_path = os.path.join(config["project_root"], "data/uae_uncoordinated.xes")
         log_length = 300
 
-    log = create_event_log(dataset_path, 10, log_length=log_length)
+    if args.incremental:
+        checkpoint_path = os.path.splitext(output_path)[0] + ".checkpoint"
+        log = create_event_log_incremental(dataset_path, checkpoint_path, 10, log_length=log_length)
+    elif args.in_memory:
+        log = create_event_log(dataset_path, 10, log_length=log_length)
+    else:
+        log = create_event_log_streaming(dataset_path, 10, log_length=log_length)
 
     pm4py.write_xes(log, output_path)
\ No newline at end of file
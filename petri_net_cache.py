@@ -0,0 +1,124 @@
+import numpy as np
+
+from event_log_cache import read_cache, write_cache, file_fingerprint
+from petri_net_index import NetArrays, get_net_index
+
+
+def _marking_to_arrays(marking, index):
+    place_ids = [index.place_id[place] for place in marking]
+    return np.array(place_ids, dtype=np.int32), np.array([marking[place] for place in marking], dtype=np.int64)
+
+
+def read_net_arrays(file_path):
+    """
+    Reads a Petri net in its integer-indexed array form, parsing the PNML only if there is no valid cache.
+
+    The first time a net is read, the PNML is parsed with pm4py and its places, transitions, labels, arcs and markings
+    are stored as integer arrays in a cache file next to it. Later reads only load these arrays.
+
+    Inputs:
+    file_path: path to a Petri net (.pnml)
+
+    Outputs:
+    arrays: the NetArrays of the net
+    im: the initial marking as a (place IDs, token counts) pair of arrays
+    fm: the final marking as a (place IDs, token counts) pair of arrays
+    """
+    cached = read_cache(file_path)
+
+    if cached is None:
+        import pm4py
+
+        fingerprint = file_fingerprint(file_path)
+        net, im, fm = pm4py.read_pnml(file_path)
+        index = get_net_index(net)
+        arrays = index.arrays
+        im_places, im_tokens = _marking_to_arrays(im, index)
+        fm_places, fm_tokens = _marking_to_arrays(fm, index)
+
+        cached = {
+            "place_names": arrays.place_names,
+            "transition_names": arrays.transition_names,
+            "transition_labels": arrays.transition_labels,
+            "silent": arrays.silent,
+            "arc_source": arrays.arc_source,
+            "arc_target": arrays.arc_target,
+            "arc_weight": arrays.arc_weight,
+            "im_places": im_places,
+            "im_tokens": im_tokens,
+            "fm_places": fm_places,
+            "fm_tokens": fm_tokens,
+        }
+        write_cache(file_path, cached, fingerprint)
+
+    arrays = NetArrays(
+        place_names=cached["place_names"],
+        transition_names=cached["transition_names"],
+        transition_labels=cached["transition_labels"],
+        silent=cached["silent"],
+        arc_source=cached["arc_source"],
+        arc_target=cached["arc_target"],
+        arc_weight=cached["arc_weight"],
+    )
+    return arrays, (cached["im_places"], cached["im_tokens"]), (cached["fm_places"], cached["fm_tokens"])
+
+
+def arrays_to_petri_net(arrays, im, fm, name="cached_net"):
+    """
+    Builds pm4py objects from the array form of a Petri net.
+
+    Inputs:
+    arrays: the NetArrays of the net
+    im: the initial marking as a (place IDs, token counts) pair of arrays
+    fm: the final marking as a (place IDs, token counts) pair of arrays
+    name: the name given to the net
+
+    Outputs:
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
+    """
+    from pm4py.objects.petri_net.obj import PetriNet, Marking
+    from pm4py.objects.petri_net.utils import petri_utils
+
+    net = PetriNet(name)
+
+    nodes = []
+    for place_name in arrays.place_names.tolist():
+        place = PetriNet.Place(place_name)
+        net.places.add(place)
+        nodes.append(place)
+
+    for transition_name, label, silent in zip(arrays.transition_names.tolist(), arrays.transition_labels.tolist(),
+                                              arrays.silent.tolist()):
+        transition = PetriNet.Transition(transition_name, None if silent else label)
+        net.transitions.add(transition)
+        nodes.append(transition)
+
+    for source, target, weight in zip(arrays.arc_source.tolist(), arrays.arc_target.tolist(), arrays.arc_weight.tolist()):
+        petri_utils.add_arc_from_to(nodes[source], nodes[target], net, weight=weight)
+
+    markings = []
+    for place_ids, tokens in (im, fm):
+        marking = Marking()
+        for place_id, count in zip(place_ids.tolist(), tokens.tolist()):
+            marking[nodes[place_id]] = count
+        markings.append(marking)
+
+    return net, markings[0], markings[1]
+
+
+def load_petri_net(file_path):
+    """
+    Loads a Petri net and its markings as pm4py objects through the array cache, as a drop-in for pm4py.read_pnml.
+
+    Inputs:
+    file_path: path to a Petri net (.pnml)
+
+    Outputs:
+    net: the Petri net
+    im: the initial marking
+    fm: the final marking
+    """
+    arrays, im, fm = read_net_arrays(file_path)
+    return arrays_to_petri_net(arrays, im, fm, name="imported_" + file_path)
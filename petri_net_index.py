@@ -0,0 +1,192 @@
+import weakref
+from types import MappingProxyType
+
+import numpy as np
+
+# Cache of indices keyed by id(net). Entries are dropped when the net is garbage collected.
+_INDEX_CACHE = {}
+
+
+class NetArrays:
+    """
+    Integer-ID, array-backed form of a Petri net used for large nets.
+
+    Places are numbered 0..n_places-1 and transitions n_places..n_places+n_transitions-1, so that
+    arcs can be stored as two flat arrays in one node space. Presets and postsets are stored in CSR
+    form (an indptr array of offsets into an indices array).
+
+    Attributes:
+    place_names: array of place names, indexed by place ID
+    transition_names: array of transition names, indexed by transition ID - n_places
+    transition_labels: array of transition labels ("" for silent transitions)
+    silent: boolean array marking silent transitions
+    arc_source, arc_target, arc_weight: arc arrays in the unified node space
+    pre_indptr, pre_indices: CSR preset (input nodes) of every node
+    post_indptr, post_indices: CSR postset (output nodes) of every node
+    """
+
+    __slots__ = ("place_names", "transition_names", "transition_labels", "silent",
+                 "arc_source", "arc_target", "arc_weight",
+                 "pre_indptr", "pre_indices", "post_indptr", "post_indices")
+
+    def __init__(self, place_names, transition_names, transition_labels, silent, arc_source, arc_target, arc_weight):
+        n_nodes = len(place_names) + len(transition_names)
+
+        fields = {
+            "place_names": np.asarray(place_names, dtype=str),
+            "transition_names": np.asarray(transition_names, dtype=str),
+            "transition_labels": np.asarray(transition_labels, dtype=str),
+            "silent": np.asarray(silent, dtype=bool),
+            "arc_source": np.asarray(arc_source, dtype=np.int32),
+            "arc_target": np.asarray(arc_target, dtype=np.int32),
+            "arc_weight": np.asarray(arc_weight, dtype=np.int32),
+        }
+        fields["pre_indptr"], fields["pre_indices"] = _to_csr(fields["arc_target"], fields["arc_source"], n_nodes)
+        fields["post_indptr"], fields["post_indices"] = _to_csr(fields["arc_source"], fields["arc_target"], n_nodes)
+
+        for key, value in fields.items():
+            value.setflags(write=False)
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("NetArrays is immutable")
+
+    @property
+    def n_places(self):
+        return len(self.place_names)
+
+    @property
+    def n_transitions(self):
+        return len(self.transition_names)
+
+    @property
+    def n_nodes(self):
+        return self.n_places + self.n_transitions
+
+    def preset(self, node_id):
+        """Returns the IDs of the input nodes of a node."""
+        return self.pre_indices[self.pre_indptr[node_id]:self.pre_indptr[node_id + 1]]
+
+    def postset(self, node_id):
+        """Returns the IDs of the output nodes of a node."""
+        return self.post_indices[self.post_indptr[node_id]:self.post_indptr[node_id + 1]]
+
+
+def _to_csr(rows, cols, n_rows):
+    """
+    Groups the (row, col) pairs by row, keeping the original pair order within each row.
+
+    Inputs:
+    rows: array of row IDs
+    cols: array of column IDs
+    n_rows: the number of rows
+
+    Outputs:
+    indptr: offsets of each row in indices
+    indices: the column IDs grouped by row
+    """
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32)
+
+
+class PetriNetIndex:
+    """
+    Precomputed, read-only adjacency structure of a Petri net.
+
+    Presets and postsets keep the order in which arcs are found in net.arcs, so iterating over them
+    gives the same order as the linear scans over net.arcs they replace. The index assumes that the net
+    is not modified after it is built.
+
+    Attributes:
+    places: tuple of places
+    transitions: tuple of transitions
+    place_preset: dict mapping a place to a tuple of its input transitions
+    place_postset: dict mapping a place to a tuple of its output transitions
+    transition_preset: dict mapping a transition to a tuple of its input places
+    transition_postset: dict mapping a transition to a tuple of its output places
+    label_to_transition: dict mapping a label to the first transition carrying that label
+    silent_transitions: frozenset of transitions without a label
+    place_id, transition_id: dicts mapping places and transitions to their IDs in arrays
+    arrays: the NetArrays form of the net
+    """
+
+    def __init__(self, net):
+        places = tuple(net.places)
+        transitions = tuple(net.transitions)
+
+        place_preset = {p: [] for p in places}
+        place_postset = {p: [] for p in places}
+        transition_preset = {t: [] for t in transitions}
+        transition_postset = {t: [] for t in transitions}
+
+        for arc in net.arcs:
+            if arc.source in place_postset:
+                place_postset[arc.source].append(arc.target)
+                transition_preset[arc.target].append(arc.source)
+            else:
+                transition_postset[arc.source].append(arc.target)
+                place_preset[arc.target].append(arc.source)
+
+        label_to_transition = {}
+        for t in transitions:
+            if t.label is not None and t.label not in label_to_transition:
+                label_to_transition[t.label] = t
+
+        self.places = places
+        self.transitions = transitions
+        self.place_preset = _freeze(place_preset)
+        self.place_postset = _freeze(place_postset)
+        self.transition_preset = _freeze(transition_preset)
+        self.transition_postset = _freeze(transition_postset)
+        self.label_to_transition = MappingProxyType(label_to_transition)
+        self.silent_transitions = frozenset(t for t in transitions if t.label is None)
+        self.place_id = MappingProxyType({p: i for i, p in enumerate(places)})
+        self.transition_id = MappingProxyType({t: i for i, t in enumerate(transitions)})
+        self._arrays = None
+        self._net_arcs = net.arcs
+
+    @property
+    def arrays(self):
+        """The NetArrays form of the net, built on first access."""
+        if self._arrays is None:
+            n_places = len(self.places)
+            node_id = {p: i for i, p in enumerate(self.places)}
+            node_id.update({t: n_places + i for i, t in enumerate(self.transitions)})
+
+            arcs = list(self._net_arcs)
+            self._arrays = NetArrays(
+                place_names=[p.name for p in self.places],
+                transition_names=[t.name for t in self.transitions],
+                transition_labels=[t.label if t.label is not None else "" for t in self.transitions],
+                silent=[t.label is None for t in self.transitions],
+                arc_source=[node_id[arc.source] for arc in arcs],
+                arc_target=[node_id[arc.target] for arc in arcs],
+                arc_weight=[arc.weight for arc in arcs],
+            )
+        return self._arrays
+
+
+def _freeze(adjacency):
+    """Converts a dict of lists into a read-only mapping of tuples."""
+    return MappingProxyType({k: tuple(v) for k, v in adjacency.items()})
+
+
+def get_net_index(net):
+    """
+    Returns the index of a Petri net, building it the first time the net is seen.
+
+    Inputs:
+    net: a Petri net
+
+    Outputs:
+    index: the PetriNetIndex of the net
+    """
+    key = id(net)
+    index = _INDEX_CACHE.get(key)
+    if index is None:
+        index = PetriNetIndex(net)
+        _INDEX_CACHE[key] = index
+        weakref.finalize(net, _INDEX_CACHE.pop, key, None)
+    return index
@@ -0,0 +1,129 @@
+DATASETS = ["brazil_1", "brazil_2", "honduras_coordinated", "honduras_uncoordinated", "uae_coordinated", "uae_uncoordinated"]
+
+FIELDS = ["dataset", "no_nodes", "density", "diameter", "ks_entropy", "mean_waiting_time", "xor_count", "and_count"]
+
+
+def compute_metrics(data_folder, dataset, constructs=False):
+
+    """
+    This function computes every metric of one dataset, loading its Petri net and event log once.
+
+    Inputs:
+    data_folder: the folder containing the .pnml and .xes files
+    dataset: the dataset name (file name without extension)
+    constructs: if True, also count the XOR and AND gates of the log's process tree (stored by discover_petri_nets.py,
+    or discovered if there is none)
+
+    Outputs:
+    row: a dictionary with one entry per metric
+    """
+    import os
+    import numpy as np
+    from event_log_cache import read_log_columns, columns_to_event_log
+    from petri_net_cache import read_net_arrays, arrays_to_petri_net
+    from free_choice_SPN import load_delay_distributions
+    from calculate_density import petri_net_density
+    from calculate_diameter import petri_net_diameter
+    from calculate_ks_entropy import ks_entropy
+    from calculate_mean_waiting_time import get_mean_waiting_times
+
+    arrays, im_arrays, fm_arrays = read_net_arrays(os.path.join(data_folder, dataset + ".pnml"))
+    columns, tz_aware = read_log_columns(os.path.join(data_folder, dataset + ".xes"))
+
+    net, im, fm = arrays_to_petri_net(arrays, im_arrays, fm_arrays, name=dataset)
+    log = columns_to_event_log(columns, tz_aware)
+
+    density, no_nodes = petri_net_density(arrays)
+    delays = load_delay_distributions(os.path.join(data_folder, dataset + ".pnml"), os.path.join(data_folder, dataset + ".xes"),
+                                      net=net, log=columns)
+    mean_times = get_mean_waiting_times(delays)
+
+    row = {
+        "dataset": dataset,
+        "no_nodes": no_nodes,
+        "density": density,
+        "diameter": petri_net_diameter(arrays),
+        "ks_entropy": float(ks_entropy(net, im, fm, log, columns=columns)),
+        # reported in seconds, as printed by calculate_mean_waiting_time.py
+        "mean_waiting_time": float(np.mean(mean_times) * 1000) if len(mean_times) > 0 else None,
+        "xor_count": None,
+        "and_count": None,
+    }
+
+    if constructs:
+        from calculate_constructs import load_process_tree, count_gates
+        row["xor_count"], row["and_count"] = count_gates(load_process_tree(os.path.join(data_folder, dataset + ".xes")))
+
+    return row
+
+
+def run_metrics(data_folder, datasets, workers=1, constructs=False):
+
+    """
+    This function computes the metrics of several datasets, running datasets concurrently on a process pool.
+
+    Inputs:
+    data_folder: the folder containing the .pnml and .xes files
+    datasets: list of dataset names
+    workers: the number of worker processes
+    constructs: if True, also count the gates of the process trees
+
+    Outputs:
+    rows: a list of result dictionaries in the order of datasets
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if workers <= 1:
+        return [compute_metrics(data_folder, dataset, constructs) for dataset in datasets]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(datasets))) as executor:
+        futures = [executor.submit(compute_metrics, data_folder, dataset, constructs) for dataset in datasets]
+        return [future.result() for future in futures]
+
+
+def write_results(rows, output_path, fields=FIELDS):
+
+    """
+    This function writes the results table to a .json or .csv file.
+
+    Inputs:
+    rows: the result dictionaries
+    output_path: the output path; the format is chosen from the extension
+    fields: the columns of the .csv file
+    """
+    import csv
+    import json
+
+    if output_path.endswith(".csv"):
+        with open(output_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(output_path, "w") as f:
+            json.dump(rows, f, indent=4)
+
+
+if __name__ == "__main__":
+    from load_config import load_config
+    import os
+    import argparse
+    import json
+
+    config = load_config()
+
+    parser = argparse.ArgumentParser(description="Compute all metrics for the datasets, loading each Petri net and event log once.")
+    parser.add_argument("--datasets", type=str, nargs="+", default=DATASETS, choices=DATASETS, help="Datasets to process (default: all six)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of datasets processed concurrently")
+    parser.add_argument("--constructs", action="store_true", help="Also count the XOR and AND gates of the process trees stored by discover_petri_nets.py")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this .json or .csv file instead of printing them")
+    args = parser.parse_args()
+
+    data_folder = os.path.join(config["project_root"], "data")
+
+    rows = run_metrics(data_folder, args.datasets, workers=args.workers, constructs=args.constructs)
+
+    if args.output is None:
+        print(json.dumps(rows, indent=4))
+    else:
+        write_results(rows, args.output)
@@ -0,0 +1,173 @@
+from collections import namedtuple
+
+import numpy as np
+
+NET_FILES = ["brazil_1.pnml", "brazil_2.pnml", "honduras_coordinated.pnml", "honduras_uncoordinated.pnml",
+             "uae_coordinated.pnml", "uae_uncoordinated.pnml"]
+
+FIELDS = ["net", "no_nodes", "no_places", "no_transitions", "no_arcs", "density", "diameter", "radius",
+          "no_strong_components", "largest_strong_component"]
+
+NetStructure = namedtuple("NetStructure", [
+    "no_nodes", "no_places", "no_transitions", "no_arcs", "density", "diameter", "radius",
+    "eccentricity", "reach", "strong_component", "no_strong_components", "largest_strong_component",
+    "in_degree", "out_degree",
+])
+NetStructure.__doc__ = """
+The structural measures of a Petri net, as computed by petri_net_structure.
+
+Every per-node array is indexed by node ID: places first, then transitions, in the order of NetArrays.
+
+Attributes:
+no_nodes, no_places, no_transitions, no_arcs: the size of the net
+density: the density of the net as a directed graph (see calculate_density.py)
+diameter: the largest eccentricity of any node
+radius: the smallest eccentricity of the nodes that reach every node, or None if no node does
+eccentricity: array with the longest shortest path from every node to a node it can reach
+reach: array with the number of nodes reachable from every node, including itself
+strong_component: array with the label of the strongly connected component of every node
+no_strong_components: the number of strongly connected components
+largest_strong_component: the number of nodes in the largest strongly connected component
+in_degree, out_degree: arrays with the number of input and output arcs of every node
+"""
+
+
+def degree_distribution(degrees):
+    """
+    Returns a dictionary mapping each degree to the number of nodes with that degree.
+    """
+    counts = np.bincount(degrees)
+    return {int(degree): int(count) for degree, count in enumerate(counts) if count > 0}
+
+
+def petri_net_structure(net, workers=1, chunk_size=256):
+
+    """
+    This function computes the structural measures of a Petri net from a single sparse adjacency matrix.
+
+    The net is converted once, and one chunked shortest path pass (see calculate_diameter.node_eccentricities) gives
+    the eccentricity of every node, from which both the diameter and the radius are taken. Strongly connected
+    components and degrees are read from the same matrix.
+
+    As not every node can reach every other node in a Petri net, the eccentricity of a node is its longest shortest
+    path to a node it can reach, so that the diameter is the same as from calculate_diameter.py. The radius is the
+    smallest eccentricity of the nodes that reach the whole net (the source place of a workflow net), or None if no
+    node does.
+
+    Inputs:
+    net: the NetArrays of a Petri net (see petri_net_cache.read_net_arrays)
+    workers: the number of processes used for the shortest paths
+    chunk_size: the number of sources whose distances are held in memory at once
+
+    Outputs:
+    structure: a NetStructure
+    """
+    from scipy.sparse.csgraph import connected_components
+    from calculate_density import petri_net_density
+    from calculate_diameter import adjacency_matrix, node_eccentricities
+
+    graph = adjacency_matrix(net)
+    density, no_nodes = petri_net_density(net)
+
+    eccentricity, reach = node_eccentricities(graph, workers=workers, chunk_size=chunk_size)
+    covering = eccentricity[reach == no_nodes]
+
+    no_components, strong_component = connected_components(graph, directed=True, connection="strong")
+
+    return NetStructure(
+        no_nodes=no_nodes,
+        no_places=net.n_places,
+        no_transitions=net.n_transitions,
+        no_arcs=len(net.arc_source),
+        density=density,
+        diameter=int(eccentricity.max()) if no_nodes > 0 else 0,
+        radius=int(covering.min()) if len(covering) > 0 else None,
+        eccentricity=eccentricity,
+        reach=reach,
+        strong_component=strong_component,
+        no_strong_components=int(no_components),
+        largest_strong_component=int(np.bincount(strong_component).max()) if no_nodes > 0 else 0,
+        in_degree=np.diff(net.pre_indptr),
+        out_degree=np.diff(net.post_indptr),
+    )
+
+
+def structure_summary(structure, n_places):
+
+    """
+    This function turns a NetStructure into a dictionary of its scalar measures and degree distributions.
+
+    Inputs:
+    structure: a NetStructure
+    n_places: the number of places of the net, which separates the place and transition nodes
+
+    Outputs:
+    summary: a dictionary with the FIELDS measures and the in- and out-degree distributions of places and transitions
+    """
+    summary = {field: getattr(structure, field) for field in FIELDS if field != "net"}
+
+    for kind, nodes in (("place", slice(None, n_places)), ("transition", slice(n_places, None))):
+        summary[kind + "_in_degree"] = degree_distribution(structure.in_degree[nodes])
+        summary[kind + "_out_degree"] = degree_distribution(structure.out_degree[nodes])
+
+    return summary
+
+
+def find_petri_net_structure(file_path, workers=1):
+
+    """
+    This function computes the structural measures of a Petri net.
+
+    Inputs:
+    file_path: the path to a Petri net
+    workers: the number of processes used for the shortest paths
+
+    Outputs:
+    structure: a NetStructure
+    net: the NetArrays of the net, giving the names of the nodes
+    """
+    from petri_net_cache import read_net_arrays
+
+    net, im, fm = read_net_arrays(file_path)
+
+    return petri_net_structure(net, workers=workers), net
+
+
+if __name__ == "__main__":
+    from load_config import load_config
+    import os
+    import argparse
+    import json
+
+    config = load_config()
+
+    parser = argparse.ArgumentParser(description="Compute the density, diameter, radius, strongly connected components and degree distributions of Petri nets.")
+    parser.add_argument("--pn", type=str, nargs="+", default=NET_FILES, choices=NET_FILES, help="Petri net filenames (default: all six)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for the shortest paths")
+    parser.add_argument("--nodes", action="store_true", help="Also output the eccentricity, degrees and component of every node")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this .json file instead of printing them")
+    args = parser.parse_args()
+
+    results = []
+    for pn in args.pn:
+        file_path = os.path.join(config["project_root"], "data", pn)
+        structure, net = find_petri_net_structure(file_path, workers=args.workers)
+
+        result = {"net": pn}
+        result.update(structure_summary(structure, net.n_places))
+        if args.nodes:
+            names = net.place_names.tolist() + net.transition_names.tolist()
+            result["nodes"] = [
+                {"name": name, "type": "place" if node < net.n_places else "transition",
+                 "eccentricity": int(structure.eccentricity[node]), "reach": int(structure.reach[node]),
+                 "in_degree": int(structure.in_degree[node]), "out_degree": int(structure.out_degree[node]),
+                 "strong_component": int(structure.strong_component[node])}
+                for node, name in enumerate(names)
+            ]
+        results.append(result)
+
+    if args.output is None:
+        print(json.dumps(results, indent=4))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from event_log_checkpoint import EventLogCheckpoint, MANIFEST_NAME
+from event_log_pipeline import CASE, ACTIVITY, TIMESTAMP, update_case_state
+
+SETTINGS = {"trim_length": 3}
+
+
+def make_events(rows, start_seq):
+    """Builds a batch of events from (case, activity, time in seconds) tuples."""
+    return pd.DataFrame({
+        CASE: np.array([row[0] for row in rows], dtype=np.int64),
+        ACTIVITY: pd.Categorical([row[1] for row in rows]),
+        TIMESTAMP: pd.to_datetime([row[2] for row in rows], unit='s'),
+        'seq': start_seq + np.arange(len(rows), dtype=np.int64),
+    })
+
+
+def apply_batches(checkpoint, batches):
+    """Appends one segment per batch, each batch read from its own offset of a single source."""
+    for offset, rows in enumerate(batches, start=1):
+        events = make_events(rows, checkpoint.next_seq)
+        updated = update_case_state(checkpoint.state, events, SETTINGS["trim_length"])
+        checkpoint.append(updated, {"source": offset}, checkpoint.next_seq + len(rows))
+
+
+def normalised_state(checkpoint):
+    state = checkpoint.state.loc[:, [CASE, ACTIVITY, TIMESTAMP, 'seq']].copy()
+    state[ACTIVITY] = state[ACTIVITY].astype(str)
+    state[CASE] = state[CASE].astype(np.int64)
+    state[TIMESTAMP] = state[TIMESTAMP].astype('datetime64[ns]')
+    return state.sort_values(by=[TIMESTAMP, 'seq'], kind='stable').reset_index(drop=True)
+
+
+BATCHES = [
+    [(1, 'ua', 10), (2, 'ub', 11), (1, 'uc', 12)],
+    # case 1 gets an earlier event and more events than trim_length, case 3 is new
+    [(1, 'ud', 5), (3, 'ue', 13), (1, 'uf', 14), (1, 'ug', 15)],
+    [(2, 'uh', 11), (3, 'ui', 1)],
+]
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path):
+    return str(tmp_path / "log.checkpoint")
+
+
+def test_reload_matches_appended_state(checkpoint_path):
+    checkpoint = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    apply_batches(checkpoint, BATCHES)
+
+    reloaded = EventLogCheckpoint(checkpoint_path, SETTINGS)
+
+    assert reloaded.segments == len(BATCHES)
+    assert reloaded.sources == {"source": len(BATCHES)}
+    assert reloaded.next_seq == sum(len(rows) for rows in BATCHES)
+    pd.testing.assert_frame_equal(normalised_state(reloaded), normalised_state(checkpoint))
+    # each case keeps its trim_length earliest events, ties broken by the order they were read
+    assert normalised_state(reloaded).groupby(CASE)[ACTIVITY].agg(list).to_dict() == {
+        1: ['ud', 'ua', 'uc'], 2: ['ub', 'uh'], 3: ['ui', 'ue'],
+    }
+
+
+def test_compact_keeps_state(checkpoint_path):
+    checkpoint = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    apply_batches(checkpoint, BATCHES)
+    before = normalised_state(checkpoint)
+
+    checkpoint.compact()
+
+    segments = [name for name in os.listdir(checkpoint_path) if name.startswith("segment_")]
+    assert len(segments) == 1
+    assert checkpoint.segments == 1
+
+    reloaded = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    assert reloaded.segments == 1
+    assert reloaded.sources == checkpoint.sources
+    assert reloaded.next_seq == checkpoint.next_seq
+    pd.testing.assert_frame_equal(normalised_state(reloaded), before)
+
+    # appending after a compaction writes a new segment that replaces the compacted rows of its cases
+    apply_batches(reloaded, [[(2, 'uj', 0)]])
+    after = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    assert after.segments == 2
+    pd.testing.assert_frame_equal(normalised_state(after), normalised_state(reloaded))
+
+
+def test_compact_if_needed(checkpoint_path):
+    checkpoint = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    apply_batches(checkpoint, BATCHES)
+
+    checkpoint.compact_if_needed(max_segments=len(BATCHES))
+    assert checkpoint.segments == len(BATCHES)
+
+    checkpoint.compact_if_needed(max_segments=len(BATCHES) - 1)
+    assert checkpoint.segments == 1
+
+
+def test_partial_manifest_line_is_ignored(checkpoint_path):
+    checkpoint = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    apply_batches(checkpoint, BATCHES[:2])
+    expected = normalised_state(checkpoint)
+
+    # an update interrupted while writing its manifest line
+    with open(os.path.join(checkpoint_path, MANIFEST_NAME), "a") as f:
+        f.write('{"version": 1, "segm')
+
+    reloaded = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    assert reloaded.segments == 2
+    assert reloaded.sources == {"source": 2}
+    pd.testing.assert_frame_equal(normalised_state(reloaded), expected)
+
+    # updates appended after the partial line are kept when the checkpoint is loaded again
+    apply_batches(reloaded, BATCHES)
+    expected = normalised_state(reloaded)
+
+    after = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    assert after.segments == 2 + len(BATCHES)
+    assert after.sources == {"source": len(BATCHES)}
+    assert after.next_seq == reloaded.next_seq
+    pd.testing.assert_frame_equal(normalised_state(after), expected)
+
+
+def test_manifest_line_without_newline_is_partial(checkpoint_path):
+    checkpoint = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    apply_batches(checkpoint, BATCHES[:1])
+    expected = normalised_state(checkpoint)
+
+    # an update interrupted after its entry but before the newline that completes it
+    manifest_path = os.path.join(checkpoint_path, MANIFEST_NAME)
+    with open(manifest_path, "r") as f:
+        line = f.readline()
+    with open(manifest_path, "a") as f:
+        f.write(line.rstrip("\n"))
+
+    reloaded = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    assert reloaded.segments == 1
+    pd.testing.assert_frame_equal(normalised_state(reloaded), expected)
+
+    apply_batches(reloaded, BATCHES[1:])
+    after = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    assert after.segments == len(BATCHES)
+    pd.testing.assert_frame_equal(normalised_state(after), normalised_state(reloaded))
+
+
+def test_changed_settings_reset(checkpoint_path):
+    checkpoint = EventLogCheckpoint(checkpoint_path, SETTINGS)
+    apply_batches(checkpoint, BATCHES)
+
+    reloaded = EventLogCheckpoint(checkpoint_path, {"trim_length": 4})
+
+    assert len(reloaded.state) == 0
+    assert reloaded.sources == {}
+    assert reloaded.next_seq == 0
+    assert reloaded.segments == 0
+    assert not os.path.exists(checkpoint_path)
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from event_log_pipeline import normalise_userids
+from generate_logs_uae_honduras import _parse_retweet_line
+
+
+def test_normalise_userids():
+    userids = pd.Series(['a+b', None, np.nan, 12, 'a=b'], index=[5, 6, 7, 8, 9])
+
+    activities = normalise_userids(userids)
+
+    assert list(activities) == ['uab', 'unan', 'unan', 'u12', 'uab']
+    assert list(activities.index) == [5, 6, 7, 8, 9]
+    # rows of the same activity share one category
+    assert list(activities.cat.categories) == ['uab', 'unan', 'u12']
+
+
+def test_missing_userid_matches_normalise_userids():
+    for line in ['{"retweet_tweetid": 5, "tweet_time": 1000}',
+                 '{"retweet_tweetid": 5, "tweet_time": 1000, "userid": null}']:
+        assert _parse_retweet_line(line)[1] == normalise_userids(pd.Series([None]))[0]
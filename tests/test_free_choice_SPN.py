@@ -0,0 +1,153 @@
+import random
+import sys
+
+import pytest
+from pm4py.objects.petri_net.obj import PetriNet
+from pm4py.objects.petri_net.utils import petri_utils
+
+from free_choice_SPN import find_all_previous_transitions, find_previous_transitions
+
+
+def recursive_find_previous_transitions(net, current_transition, visited_transitions=None, visited_places=None):
+    """The original recursive search, kept as the reference for the iterative one."""
+    if visited_transitions is None:
+        visited_transitions = set()
+    if visited_places is None:
+        visited_places = set()
+
+    visited_transitions.add(current_transition)
+
+    transition_list = []
+
+    while len(transition_list) == 0:
+        places = [arc.source for arc in net.arcs if arc.target == current_transition]
+
+        if len(places) == 0 or places[0].name == 'source':
+            break
+
+        if len(places) > 1:
+            synchronised_transitions = []
+            for place in places:
+                input_transitions = [arc.source for arc in net.arcs if arc.target == place]
+
+                for t in input_transitions:
+                    visited_transitions.add(t)
+                visited_places.add(place)
+
+                for t in input_transitions:
+                    if t.label is not None:
+                        synchronised_transitions.append(t)
+                    else:
+                        synchronised_transitions.extend(recursive_find_previous_transitions(net, t, visited_transitions, visited_places))
+
+            flat_synchronised_transitions = [item for sublist in synchronised_transitions for item in (sublist if isinstance(sublist, list) else [sublist])]
+
+            transition_list.append(flat_synchronised_transitions)
+            break
+
+        found_transition = False
+        for place in places:
+            if place in visited_places:
+                continue
+
+            visited_places.add(place)
+
+            input_transitions = [arc.source for arc in net.arcs if arc.target == place]
+
+            for input_transition in input_transitions:
+                if input_transition in visited_transitions:
+                    continue
+
+                visited_transitions.add(input_transition)
+
+                if input_transition.label is not None:
+                    transition_list.append([input_transition])
+                    found_transition = True
+
+                if input_transition.label is None:
+                    transition_list.extend(recursive_find_previous_transitions(net, input_transition, visited_transitions, visited_places))
+
+        if not found_transition:
+            break
+
+    return transition_list
+
+
+def names(transition_list):
+    return [[t.name for t in t_list] for t_list in transition_list]
+
+
+def random_net(seed, n_places=8, n_transitions=12):
+    """
+    A random net with a source place, silent transitions, synchronisations and cycles through silent transitions.
+    """
+    rng = random.Random(seed)
+    net = PetriNet("random_{}".format(seed))
+
+    places = [PetriNet.Place("source")] + [PetriNet.Place("p{}".format(i)) for i in range(1, n_places)]
+    transitions = [PetriNet.Transition("t{}".format(i), None if rng.random() < 0.4 else "a{}".format(i))
+                   for i in range(n_transitions)]
+    for node in places:
+        net.places.add(node)
+    for node in transitions:
+        net.transitions.add(node)
+
+    for t in transitions:
+        n_inputs = 1 if rng.random() < 0.7 else 2
+        for place in rng.sample(places, n_inputs):
+            petri_utils.add_arc_from_to(place, t, net)
+        for place in rng.sample(places[1:], rng.randint(1, 2)):
+            petri_utils.add_arc_from_to(t, place, net)
+
+    return net
+
+
+@pytest.mark.parametrize("seed", range(500))
+def test_matches_recursive_search(seed):
+    net = random_net(seed)
+    labelled = sorted((t for t in net.transitions if t.label is not None), key=lambda t: t.name)
+
+    expected = {}
+    for t in labelled:
+        try:
+            expected[t] = names(recursive_find_previous_transitions(net, t))
+        except RecursionError:
+            # the recursive search never ends on cycles of synchronised silent transitions
+            continue
+
+    swept = find_all_previous_transitions(net)
+    for t, result in expected.items():
+        assert names(find_previous_transitions(net, t)) == result
+        assert names(swept[t]) == result
+
+
+def test_deep_silent_chain():
+    depth = 20000
+    net = PetriNet("chain")
+    source = PetriNet.Place("source")
+    net.places.add(source)
+
+    first = PetriNet.Transition("first", "a")
+    net.transitions.add(first)
+    petri_utils.add_arc_from_to(source, first, net)
+
+    previous = first
+    for i in range(depth):
+        place = PetriNet.Place("p{}".format(i))
+        silent = PetriNet.Transition("tau{}".format(i), None)
+        net.places.add(place)
+        net.transitions.add(silent)
+        petri_utils.add_arc_from_to(previous, place, net)
+        petri_utils.add_arc_from_to(place, silent, net)
+        previous = silent
+
+    place = PetriNet.Place("p_last")
+    last = PetriNet.Transition("last", "b")
+    net.places.add(place)
+    net.transitions.add(last)
+    petri_utils.add_arc_from_to(previous, place, net)
+    petri_utils.add_arc_from_to(place, last, net)
+
+    assert depth > sys.getrecursionlimit()
+    assert names(find_previous_transitions(net, last)) == [["first"]]
+    assert names(find_all_previous_transitions(net)[last]) == [["first"]]
@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+from generate_logs_brazil import _complete_rows_end, create_brazil_event_logs_incremental, read_brazil_file
+
+HEADER = 'retweeted_status.id_str,text,user.id_str,timestamp_ms,botscore\n'
+
+
+def make_row(tweet, text, user, time, botscore=0.95):
+    return '{},"{}",{},{},{}\n'.format(tweet, text, user, time, botscore)
+
+
+ROWS = [
+    make_row(1, 'first', 11, 1000),
+    make_row(1, 'a "" quoted\nline, over\ntwo newlines', 12, 2000),
+    make_row(2, 'plain', 13, 3000),
+    make_row(2, 'ends in a newline\n', 14, 4000),
+    make_row(1, 'last', 15, 5000),
+]
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    return tmp_path / "tweets.csv"
+
+
+def test_complete_rows_end_skips_newlines_in_quotes(csv_path):
+    complete = HEADER + ''.join(ROWS[:1])
+    # the second row is still being written, and its last newline is inside the quoted text
+    csv_path.write_bytes((complete + ROWS[1][:ROWS[1].index('two')]).encode())
+
+    assert _complete_rows_end(str(csv_path)) == len(complete.encode())
+    assert _complete_rows_end(str(csv_path), block_size=7) == len(complete.encode())
+
+
+@pytest.mark.parametrize("block_size", [1 << 20, 5])
+def test_read_appended_rows_across_quoted_newlines(csv_path, block_size):
+    full = HEADER + ''.join(ROWS)
+    full_path = csv_path.parent / "full.csv"
+    full_path.write_bytes(full.encode())
+    expected = read_brazil_file(str(full_path))
+
+    # the file grows in pieces that cut through the quoted fields, and each run reads the complete rows added
+    frames = []
+    start = 0
+    for cut in range(0, len(full) + 1, 9):
+        csv_path.write_bytes(full[:cut].encode())
+        end = _complete_rows_end(str(csv_path), start, block_size=block_size)
+        if end > start:
+            frames.append(read_brazil_file(str(csv_path), start=start, end=end))
+            start = end
+    csv_path.write_bytes(full.encode())
+    end = _complete_rows_end(str(csv_path), start, block_size=block_size)
+    if end > start:
+        frames.append(read_brazil_file(str(csv_path), start=start, end=end))
+
+    assert end == len(full.encode())
+    df = pd.concat(frames, ignore_index=True)
+    df['userid'] = df['userid'].astype(str)
+    expected['userid'] = expected['userid'].astype(str)
+    pd.testing.assert_frame_equal(df, expected.reset_index(drop=True))
+
+
+def test_incremental_logs_across_quoted_newlines(tmp_path):
+    folder = tmp_path / "data" / "brazil_elections-2018"
+    folder.mkdir(parents=True)
+    csv_path = folder / "tweets.csv"
+    full = HEADER + ''.join(ROWS)
+    checkpoint_path = str(tmp_path / "data" / "brazil.checkpoint")
+
+    # first run: the file ends inside the quoted text of the second row
+    csv_path.write_bytes(full[:full.index('two newlines')].encode())
+    logs = create_brazil_event_logs_incremental(str(tmp_path), checkpoint_path, 10, 200, workers=1)
+    assert len(logs["brazil_1"]) == 0
+
+    csv_path.write_bytes(full.encode())
+    logs = create_brazil_event_logs_incremental(str(tmp_path), checkpoint_path, 10, 200, workers=1)
+
+    traces = sorted((trace.attributes['concept:name'], [event['concept:name'] for event in trace])
+                    for trace in logs["brazil_1"])
+    assert traces == [(1, ['u11', 'u12', 'u15']), (2, ['u13', 'u14'])]
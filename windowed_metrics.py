@@ -0,0 +1,313 @@
+import numpy as np
+
+FIELDS = ["window_start", "window_end", "n_traces", "n_events", "no_nodes", "density", "diameter", "ks_entropy"]
+
+# results of the same window selection are reused while these settings are unchanged
+WINDOW_CACHE_VERSION = 1
+
+
+def load_jsonl_stream(file_path):
+
+    """
+    This function reads the retweet events of a Honduras or UAE jsonlines file as a single stream sorted by time.
+
+    Inputs:
+    file_path: the path to a jsonlines file from the Honduras or UAE datasets
+
+    Outputs:
+    stream: a DataFrame with case:concept:name, concept:name and time:timestamp columns, sorted by time
+    """
+    from generate_logs_uae_honduras import stream_retweet_events
+    import pandas as pd
+
+    times, activities, cases = [], [], []
+    for time, activity, case in stream_retweet_events(file_path):
+        times.append(time)
+        activities.append(activity)
+        cases.append(case)
+
+    stream = pd.DataFrame({
+        'case:concept:name': pd.array(cases, dtype='Int64'),
+        'concept:name': pd.Categorical(activities),
+        'time:timestamp': pd.to_datetime(times, unit='ns'),
+    })
+    return stream.sort_values(by='time:timestamp', kind='stable').reset_index(drop=True)
+
+
+def load_brazil_stream(project_root, cohort_name, cohorts, workers=None):
+
+    """
+    This function reads the retweet events of one bot score cohort of the Brazil dataset as a stream sorted by time.
+
+    Inputs:
+    project_root: path to the project root, containing data/brazil_elections-2018
+    cohort_name: the name of the cohort
+    cohorts: the list of Cohorts
+    workers: the number of processes used to read the files (default: the number of CPUs)
+
+    Outputs:
+    stream: a DataFrame with case:concept:name, concept:name and time:timestamp columns, sorted by time
+    """
+    from generate_logs_brazil import read_brazil_file
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    import os
+    import pandas as pd
+
+    cohort = [c for c in cohorts if c.name == cohort_name]
+    if not cohort:
+        raise ValueError("unknown cohort: {}".format(cohort_name))
+
+    folder_path = os.path.join(project_root, "data/brazil_elections-2018")
+    file_paths = sorted(os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(".csv"))
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    read_file = partial(read_brazil_file, cohorts=cohort)
+    if workers <= 1 or len(file_paths) <= 1:
+        partitions = [read_file(file_path) for file_path in file_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+            partitions = list(executor.map(read_file, file_paths))
+
+    stream = pd.concat([partition.drop(columns='cohort') for partition in partitions], ignore_index=True)
+    stream.columns = ['case:concept:name', 'concept:name', 'time:timestamp']
+    stream['concept:name'] = stream['concept:name'].astype('category')
+    return stream.sort_values(by='time:timestamp', kind='stable').reset_index(drop=True)
+
+
+def window_bounds(stream, width, step):
+
+    """
+    This function computes overlapping windows of a time-sorted stream.
+
+    Windows are [start, start + width), with starts every step from the first event's time floored to step, so that the
+    windows stay the same when events are appended to the stream.
+
+    Inputs:
+    stream: a DataFrame sorted by time:timestamp
+    width: the length of a window, as a pandas Timedelta or string such as "7D"
+    step: the time between the starts of consecutive windows
+
+    Outputs:
+    windows: a list of (start, end, first row, last row + 1) tuples, one per window
+    """
+    import pandas as pd
+
+    width, step = pd.Timedelta(width), pd.Timedelta(step)
+    if width <= pd.Timedelta(0) or step <= pd.Timedelta(0):
+        raise ValueError("window width and step must be positive")
+    if len(stream) == 0:
+        return []
+
+    times = stream['time:timestamp'].to_numpy(dtype='datetime64[ns]')
+    starts = pd.date_range(pd.Timestamp(times[0]).floor(step), pd.Timestamp(times[-1]), freq=step)
+    ends = starts + width
+
+    # the stream is sorted, so every window is a contiguous slice of it
+    first = np.searchsorted(times, starts.to_numpy(dtype='datetime64[ns]'), side='left')
+    last = np.searchsorted(times, ends.to_numpy(dtype='datetime64[ns]'), side='left')
+
+    return list(zip(starts, ends, first.tolist(), last.tolist()))
+
+
+def select_window(window_df, trim_length, log_length, dedup=False):
+
+    """
+    This function selects the events of one window's log from its slice of the time-sorted stream.
+
+    Inputs:
+    window_df: the events of the window, sorted by time
+    trim_length: length to trim each trace to
+    log_length: desired number of traces
+    dedup: if True, only the earliest event of each activity within each case is kept (as for the Brazil logs)
+
+    Outputs:
+    short_df: the selected events, sorted by time
+    """
+    from event_log_pipeline import trim_and_truncate
+
+    if dedup:
+        # the slice is sorted, so the first occurrence is the earliest and the order is kept
+        window_df = window_df[~window_df.duplicated(subset=['case:concept:name', 'concept:name'])]
+
+    return trim_and_truncate(window_df, trim_length, log_length, presorted=True)
+
+
+def window_digest(short_df, settings):
+
+    """
+    Returns a SHA-256 of the selected events of a window and the settings, identifying its cached results.
+    """
+    import hashlib
+    import json
+    import pandas as pd
+
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    digest.update(pd.util.hash_pandas_object(short_df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def window_metrics(short_df, pnml_path=None, multi_processing=False):
+
+    """
+    This function discovers the Petri net of one window and computes its KS entropy, density and diameter.
+
+    Inputs:
+    short_df: the selected events of the window
+    pnml_path: if given, the discovered net is written to this path
+    multi_processing: passed on to the inductive miner
+
+    Outputs:
+    row: a dictionary with the size of the log and the metrics of its net
+    """
+    import pm4py
+    from event_log_pipeline import dataframe_to_event_log
+    from discover_petri_nets import discover_petri_net
+    from petri_net_index import get_net_index
+    from calculate_density import petri_net_density
+    from calculate_diameter import petri_net_diameter
+    from calculate_ks_entropy import ks_entropy
+
+    row = {"n_traces": int(short_df['case:concept:name'].nunique()), "n_events": len(short_df),
+           "no_nodes": None, "density": None, "diameter": None, "ks_entropy": None}
+    if len(short_df) == 0:
+        return row
+
+    log = dataframe_to_event_log(short_df)
+    net, im, fm = discover_petri_net(log, multi_processing=multi_processing)
+    if pnml_path is not None:
+        pm4py.write_pnml(net, im, fm, pnml_path)
+
+    arrays = get_net_index(net).arrays
+    row["density"], row["no_nodes"] = petri_net_density(arrays)
+    row["diameter"] = petri_net_diameter(arrays)
+    row["ks_entropy"] = float(ks_entropy(net, im, fm, log))
+    return row
+
+
+def _cached_window_metrics(short_df, cache_folder, digest, multi_processing):
+    import json
+    import os
+
+    row = window_metrics(short_df, os.path.join(cache_folder, digest + ".pnml"), multi_processing)
+
+    tmp_path = os.path.join(cache_folder, digest + ".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(row, f)
+    os.replace(tmp_path, os.path.join(cache_folder, digest + ".json"))
+    return row
+
+
+def windowed_metrics(stream, width, step, trim_length, log_length, cache_folder, dedup=False, workers=1):
+
+    """
+    This function computes a time series of KS entropy, density and diameter over overlapping windows of an event
+    stream, discovering one Petri net per window.
+
+    The stream is sorted once and every window is a slice of it. The log of each window is selected as by the log
+    generators (trim to trim_length events, remove traces of length 1, keep the first log_length traces) and its
+    results, together with its net, are cached in cache_folder under a digest of the selected events. Windows whose
+    selection has not changed are read from the cache, so adding a window only costs that window's discovery.
+    The remaining windows are discovered on a process pool.
+
+    Inputs:
+    stream: a DataFrame with case:concept:name, concept:name and time:timestamp columns, sorted by time
+    width: the length of a window, e.g. "7D"
+    step: the time between the starts of consecutive windows, e.g. "1D"
+    trim_length: length to trim each trace to
+    log_length: desired number of traces per window
+    cache_folder: folder of the cached window results
+    dedup: if True, only the earliest event of each activity within each case of a window is kept
+    workers: the maximum number of processes used; windows are discovered concurrently on a pool of this size
+
+    Outputs:
+    rows: a list of result dictionaries, one per window in time order
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import json
+    import os
+
+    os.makedirs(cache_folder, exist_ok=True)
+    settings = {"version": WINDOW_CACHE_VERSION, "trim_length": trim_length, "log_length": log_length, "dedup": dedup}
+
+    rows = []
+    pending = {}
+    for start, end, first, last in window_bounds(stream, width, step):
+        short_df = select_window(stream.iloc[first:last], trim_length, log_length, dedup)
+        digest = window_digest(short_df, settings)
+
+        row = {"window_start": start.isoformat(), "window_end": end.isoformat()}
+        rows.append(row)
+
+        cache_path = os.path.join(cache_folder, digest + ".json")
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                row.update(json.load(f))
+        else:
+            pending.setdefault(digest, (short_df, []))[1].append(row)
+
+    print("{} windows, {} to discover...".format(len(rows), len(pending)))
+
+    # pm4py only uses its own pool, of one process per CPU, when the windows are not spread over a pool and the
+    # --workers budget covers every CPU
+    if workers <= 1 or len(pending) <= 1:
+        multi_processing = workers >= (os.cpu_count() or 1)
+        for digest, (short_df, window_rows) in pending.items():
+            result = _cached_window_metrics(short_df, cache_folder, digest, multi_processing=multi_processing)
+            for row in window_rows:
+                row.update(result)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {digest: executor.submit(_cached_window_metrics, short_df, cache_folder, digest, False)
+                       for digest, (short_df, _) in pending.items()}
+            for digest, future in futures.items():
+                for row in pending[digest][1]:
+                    row.update(future.result())
+
+    return rows
+
+
+if __name__ == "__main__":
+    from load_config import load_config
+    from generate_logs_brazil import cohorts_from_config
+    from run_metrics import write_results
+    import os
+    import argparse
+    import json
+
+    config = load_config()
+    cohorts = cohorts_from_config(config)
+    jsonl_datasets = {"uae-bad-anonymized": 300, "uae-good-anonymized": 300,
+                      "honduras-bad-anonymized": 400, "honduras-good-anonymized": 400}
+
+    parser = argparse.ArgumentParser(description="Compute KS entropy, density and diameter over sliding time windows of a dataset.")
+    parser.add_argument("--dataset", type=str, required=True, choices=list(jsonl_datasets) + [cohort.name for cohort in cohorts],
+                        help="A UAE or Honduras jsonlines file, or a Brazil bot score cohort")
+    parser.add_argument("--width", type=str, default="7D", help="Window length, as a pandas time delta (default: 7D)")
+    parser.add_argument("--step", type=str, default="1D", help="Time between window starts (default: 1D)")
+    parser.add_argument("--log-length", type=int, default=None, help="Number of traces per window (default: as for the full log)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of windows discovered concurrently")
+    parser.add_argument("--output", type=str, default=None, help="Write the series to this .json or .csv file instead of printing it")
+    args = parser.parse_args()
+
+    data_folder = os.path.join(config["project_root"], "data")
+
+    if args.dataset in jsonl_datasets:
+        stream = load_jsonl_stream(os.path.join(data_folder, args.dataset))
+        log_length, dedup = jsonl_datasets[args.dataset], False
+    else:
+        stream = load_brazil_stream(config["project_root"], args.dataset, cohorts, workers=args.workers)
+        log_length, dedup = 200, True
+
+    if args.log_length is not None:
+        log_length = args.log_length
+
+    cache_folder = os.path.join(data_folder, args.dataset + ".windows")
+    rows = windowed_metrics(stream, args.width, args.step, 10, log_length, cache_folder, dedup=dedup, workers=args.workers)
+
+    if args.output is None:
+        print(json.dumps(rows, indent=4))
+    else:
+        write_results(rows, args.output, fields=FIELDS)